@@ -0,0 +1,135 @@
+"""
+Reemplazo local de gspread para el benchmark: una hoja en memoria con latencia y errores
+de cuota configurables, que cuenta solicitudes y celdas leídas y escritas.
+"""
+import threading
+import time
+from contextlib import contextmanager
+from unittest import mock
+
+import gspread
+import requests
+from google.oauth2 import service_account
+from gspread.exceptions import APIError
+from gspread.utils import a1_range_to_grid_range, rowcol_to_a1
+
+def quota_error():
+    response = requests.Response()
+    response.status_code = 429
+    response._content = b'{"error": {"code": 429, "message": "Quota exceeded (benchmark)", "status": "RESOURCE_EXHAUSTED"}}'
+    return APIError(response)
+
+class FakeWorksheet:
+    """
+    Hoja en memoria compatible con los métodos de gspread.Worksheet que usa la app.
+
+    `latency` se suma a cada solicitud (segundos). Con `quota_every=N`, una de cada N
+    solicitudes falla con un error 429.
+    """
+
+    def __init__(self, data, latency=0.0, quota_every=None):
+        self.data = [list(row) for row in data]
+        self.latency = latency
+        self.quota_every = quota_every
+        self.lock = threading.Lock()
+        self.reset_counters()
+
+    def reset_counters(self):
+        self.requests = {}
+        self.cells_read = 0
+        self.cells_written = 0
+        self.quota_errors = 0
+
+    def _request(self, method):
+        time.sleep(self.latency)
+        with self.lock:
+            total = sum(self.requests.values()) + 1
+            self.requests[method] = self.requests.get(method, 0) + 1
+            if self.quota_every and total % self.quota_every == 0:
+                self.quota_errors += 1
+                raise quota_error()
+
+    def _grid(self, a1):
+        if ":" in a1 and not any(ch.isdigit() for ch in a1):
+            start, end = a1.split(":")
+            a1 = f"{start}1:{end}{max(len(self.data), 1)}"
+        return a1_range_to_grid_range(a1)
+
+    def _read(self, a1, major_dimension=None):
+        g = self._grid(a1)
+        rows = [row[g["startColumnIndex"]:g["endColumnIndex"]] for row in self.data[g["startRowIndex"]:g["endRowIndex"]]]
+        # La API omite las celdas vacías al final de cada fila o columna
+        if major_dimension == "COLUMNS":
+            rows = [list(col) for col in zip(*rows)]
+        trimmed = []
+        for values in rows:
+            end = len(values)
+            while end and values[end - 1] == "":
+                end -= 1
+            trimmed.append(values[:end])
+        while trimmed and not trimmed[-1]:
+            trimmed.pop()
+        self.cells_read += sum(len(v) for v in trimmed)
+        return trimmed
+
+    def get_all_values(self, **kwargs):
+        self._request("get_all_values")
+        self.cells_read += sum(len(row) for row in self.data)
+        return [list(row) for row in self.data]
+
+    def col_values(self, col, **kwargs):
+        self._request("col_values")
+        letter = rowcol_to_a1(1, col)[:-1]
+        values = self._read(f"{letter}:{letter}", "COLUMNS")
+        return values[0] if values else []
+
+    def batch_get(self, ranges, major_dimension=None, **kwargs):
+        self._request("batch_get")
+        return [self._read(a1, major_dimension) for a1 in ranges]
+
+    def update_cells(self, cells, **kwargs):
+        self._request("update_cells")
+        for cell in cells:
+            self._write(cell.row, cell.col, cell.value)
+
+    def batch_update(self, data, **kwargs):
+        self._request("batch_update")
+        for update in data:
+            g = a1_range_to_grid_range(update["range"])
+            for i, values in enumerate(update["values"]):
+                for j, value in enumerate(values):
+                    self._write(g["startRowIndex"] + i + 1, g["startColumnIndex"] + j + 1, value)
+
+    def _write(self, row, col, value):
+        while len(self.data) < row:
+            self.data.append([""] * len(self.data[0]))
+        if len(self.data[row - 1]) < col:
+            self.data[row - 1].extend([""] * (col - len(self.data[row - 1])))
+        self.data[row - 1][col - 1] = value
+        self.cells_written += 1
+
+class FakeSpreadsheet:
+    def __init__(self, worksheet):
+        self.sheet1 = worksheet
+
+    def worksheet(self, title):
+        return self.sheet1
+
+class FakeClient:
+    def __init__(self, worksheet):
+        self.worksheet = worksheet
+
+    def open_by_url(self, url):
+        return FakeSpreadsheet(self.worksheet)
+
+    def set_timeout(self, timeout):
+        pass
+
+@contextmanager
+def patched_google(worksheet):
+    """
+    Hace que code.py use `worksheet` en lugar de conectarse a Google.
+    """
+    with mock.patch.object(service_account.Credentials, "from_service_account_info", lambda *a, **k: object()), \
+            mock.patch.object(gspread, "authorize", lambda *a, **k: FakeClient(worksheet)):
+        yield
@@ -0,0 +1,142 @@
+"""
+Benchmark de code.py sin cuenta de Google: hojas sintéticas, una hoja falsa en memoria y
+escenarios ejecutados con AppTest de Streamlit.
+
+Para cada tamaño de hoja se mide tiempo, memoria máxima (tracemalloc) y solicitudes y
+celdas enviadas a la API falsa en: carga inicial, orden de cuentas, búsqueda de filas,
+tabla de estado y guardado sobre N sectores.
+
+Uso:
+    python -m benchmarks.run
+    python -m benchmarks.run --rows 1000 10000 --latency 0.1 --sectors 50 --json resultados.json
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+import tracemalloc
+
+import streamlit as st
+from streamlit.testing.v1 import AppTest
+
+import sheet_data
+
+from .fake_sheet import FakeWorksheet, patched_google
+from .synthetic import generate_sheet
+
+CODE_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "code.py")
+
+SECRETS = {
+    "spreadsheet_url": "https://docs.google.com/spreadsheets/d/benchmark",
+    "gcp_service_account": {"type": "service_account"},
+}
+ORDER_OPTIONS = ["Más antiguos primero", "Orden alfabético", "Más recientes primero"]
+BIG_ACCOUNT = "Cuenta Grande"
+
+def new_app(timeout):
+    at = AppTest.from_file(CODE_PATH, default_timeout=timeout)
+    for key, value in SECRETS.items():
+        at.secrets[key] = value
+    return at
+
+def check(at):
+    if at.exception:
+        raise RuntimeError(at.exception[0].message)
+    return at
+
+def click(at, label):
+    next(b for b in at.button if b.label == label).click().run()
+    return check(at)
+
+def measure(results, size, name, sheet, fn):
+    sheet.reset_counters()
+    if tracemalloc.is_tracing():
+        tracemalloc.reset_peak()
+    start = time.perf_counter()
+    fn()
+    wall = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory() if tracemalloc.is_tracing() else (0, 0)
+    result = {
+        "rows": size,
+        "scenario": name,
+        "wall_ms": round(wall * 1000, 1),
+        "peak_mb": round(peak / 2**20, 1),
+        "requests": sum(sheet.requests.values()),
+        "by_method": dict(sheet.requests),
+        "cells_read": sheet.cells_read,
+        "cells_written": sheet.cells_written,
+        "quota_errors": sheet.quota_errors,
+    }
+    results.append(result)
+    print(f"{size:>8} {name:<38} {result['wall_ms']:>10.1f} {result['peak_mb']:>9.1f} "
+          f"{result['requests']:>5} {result['cells_read']:>10} {result['cells_written']:>8}")
+
+def wait_for_writes(sheet, timeout):
+    deadline = time.monotonic() + timeout
+    while not sheet.requests.get("batch_update") and not sheet.requests.get("update_cells"):
+        if time.monotonic() > deadline:
+            raise RuntimeError("La cola de escrituras no envió los cambios a tiempo")
+        time.sleep(0.01)
+
+def run_size(size, args, results):
+    st.cache_data.clear()
+    st.cache_resource.clear()
+    # Copia en disco nueva por tamaño, para que la carga inicial sea un arranque en frío real
+    sheet_data.SNAPSHOT_DIR = tempfile.mkdtemp(prefix="bench-snapshot-")
+    sheet = FakeWorksheet(generate_sheet(size, big_account_sectors=max(args.sectors, 60)),
+                          latency=args.latency, quota_every=args.quota_every)
+    with patched_google(sheet):
+        at = new_app(args.timeout)
+        measure(results, size, "carga inicial", sheet, lambda: check(at.run()))
+
+        def sort_accounts():
+            for option in ORDER_OPTIONS:
+                check(at.radio[0].set_value(option).run())
+        measure(results, size, "ordenar cuentas (3 órdenes)", sheet, sort_accounts)
+
+        check(at.selectbox(key="cuenta").select(BIG_ACCOUNT).run())
+        measure(results, size, "buscar todos los sectores + tabla", sheet, lambda: click(at, "Buscar Registro"))
+
+        if at.number_input:
+            measure(results, size, "tabla de estado: otra página", sheet,
+                    lambda: check(at.number_input(key="status_page").set_value(2).run()))
+        measure(results, size, "rerun sin cambios", sheet, lambda: check(at.run()))
+
+        sectors = sorted({row[1] for row in sheet.data[1:] if row[0] == BIG_ACCOUNT})[:args.sectors]
+        check(at.multiselect[0].set_value(sectors).run())
+        click(at, "Buscar Registro")
+
+        def save():
+            current = at.selectbox(key="process_0_update")
+            new_value = next(opt for opt in current.options if opt not in (current.value, "Vacío"))
+            check(current.select(new_value).run())
+            click(at, "Guardar Cambios")
+            wait_for_writes(sheet, args.timeout)
+        measure(results, size, f"guardar {len(sectors)} sectores", sheet, save)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, nargs="+", default=[1_000, 10_000, 100_000], help="tamaños de hoja (filas cuenta/sector)")
+    parser.add_argument("--sectors", type=int, default=50, help="sectores a guardar en el escenario de escritura")
+    parser.add_argument("--latency", type=float, default=0.0, help="latencia simulada por solicitud (s)")
+    parser.add_argument("--quota-every", type=int, default=None, help="una de cada N solicitudes falla con 429")
+    parser.add_argument("--timeout", type=float, default=300, help="tiempo máximo por ejecución de la app (s)")
+    parser.add_argument("--no-memory", action="store_true", help="no medir memoria (tracemalloc hace más lenta la app)")
+    parser.add_argument("--json", help="guardar resultados en este archivo")
+    args = parser.parse_args()
+
+    print(f"{'filas':>8} {'escenario':<38} {'ms':>10} {'MB máx':>9} {'req':>5} {'celdas lei':>10} {'escritas':>8}")
+    if not args.no_memory:
+        tracemalloc.start()
+    results = []
+    for size in args.rows:
+        run_size(size, args, results)
+    tracemalloc.stop()
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+
+if __name__ == "__main__":
+    main()
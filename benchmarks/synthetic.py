@@ -0,0 +1,60 @@
+"""
+Generador de planillas sintéticas con el mismo formato de 32 columnas que usa code.py.
+
+La estructura (columnas de estado, observación y fecha de cada proceso, y sus opciones)
+se toma de la lista `processes` de sheet_data, para que el benchmark siga al esquema real.
+"""
+import random
+from datetime import datetime, timedelta
+
+from sheet_data import TIMESTAMP_FORMAT, SHEET_WIDTH, processes as sheet_processes
+
+def generate_sheet(n_rows, big_account_sectors=200, seed=0, processes=None):
+    """
+    Retorna una hoja (lista de filas, con encabezado) de `n_rows` filas cuenta/sector.
+
+    Las cuentas tienen entre 1 y 20 sectores, salvo "Cuenta Grande", que tiene
+    `big_account_sectors` sectores para medir la tabla de estado y guardados masivos.
+    """
+    processes = processes or sheet_processes
+    rng = random.Random(seed)
+    now = datetime(2025, 1, 1)
+
+    header = [""] * SHEET_WIDTH
+    header[:3] = ["Cuenta", "Sector de Riego", "Consultoría"]
+    for proc in processes:
+        header[proc["step_col"] - 1] = proc["name"]
+        header[proc["obs_col"] - 1] = f"Observaciones - {proc['name']}"
+        header[proc["date_col"] - 1] = f"Fecha - {proc['name']}"
+    header[30] = "Comentarios"
+    header[31] = "Última Actualización"
+
+    def stamp():
+        return (now - timedelta(minutes=rng.randrange(365 * 24 * 60))).strftime(TIMESTAMP_FORMAT)
+
+    def make_row(cuenta, sector):
+        row = [""] * SHEET_WIDTH
+        row[0] = cuenta
+        row[1] = sector
+        row[2] = rng.choice(["Sí", "No", ""])
+        for proc in processes:
+            value = rng.choice(proc["options"] + [""])
+            row[proc["step_col"] - 1] = value
+            if value and rng.random() < 0.3:
+                row[proc["obs_col"] - 1] = f"Observación {rng.randrange(10_000)} sobre {proc['name'].lower()}"
+            if value.startswith("Sí") or value == "Programado":
+                row[proc["date_col"] - 1] = stamp()
+        if rng.random() < 0.2:
+            row[30] = f"Comentario general {rng.randrange(10_000)}"
+        row[31] = stamp()
+        return row
+
+    rows = [header]
+    big = min(big_account_sectors, n_rows)
+    rows.extend(make_row("Cuenta Grande", f"Sector {i:04d}") for i in range(big))
+    account = 0
+    while len(rows) <= n_rows:
+        account += 1
+        for i in range(min(rng.randint(1, 20), n_rows + 1 - len(rows))):
+            rows.append(make_row(f"Cuenta {account:05d}", f"Sector {i:02d}"))
+    return rows
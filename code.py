@@ -1,18 +1,31 @@
 import streamlit as st
 import streamlit.components.v1 as components
-import gspread
 from gspread import Cell
-from datetime import datetime
-from google.oauth2.service_account import Credentials
+from datetime import datetime, timedelta
+from gspread.utils import rowcol_to_a1
+from gspread.exceptions import APIError
+import os
+import json
 import time
-import pandas as pd
-from zoneinfo import ZoneInfo
+import math
+import io
+import random
+import html
+import functools
+import contextlib
+import itertools
+import bisect
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import logging
+from streamlit.runtime.scriptrunner import get_script_run_ctx
 
-def get_chile_timestamp():
-    """
-    Retorna la fecha y hora actual en la zona horaria de Chile con el formato deseado.
-    """
-    return datetime.now(ZoneInfo("America/Santiago")).strftime('%d-%m-%y %H:%M')
+from sheet_data import (
+    TIMESTAMP_FORMAT, chile_now, get_chile_timestamp, processes, LAST_UPDATE_COL, SHEET_WIDTH,
+    CONSULTORIA_COL, COMENTARIOS_COL, DATED_STATES, cell_value, sheet_configs, authorize,
+    open_worksheet, column_letter, coalesce_runs, overview_columns, snapshot_path,
+    ORDER_OPTIONS, parse_timestamp, SheetIndex, find_rows, SnapshotFile, ChangeLog, change_log_path,
+)
 
 # Configuración de la página
 st.set_page_config(
@@ -21,99 +34,1103 @@ st.set_page_config(
     layout="wide"
 )
 
-# Configuración: URL de la hoja de cálculo
-SPREADSHEET_URL = st.secrets["spreadsheet_url"]
-
 # Función para reiniciar la búsqueda
 def reset_search():
-    st.session_state.rows = None
-
-# Configuración de credenciales
-scope = [
-    'https://www.googleapis.com/auth/spreadsheets',
-    'https://www.googleapis.com/auth/drive'
-]
-credentials = Credentials.from_service_account_info(
-    st.secrets["gcp_service_account"], scopes=scope
-)
-gc = gspread.authorize(credentials)
-sheet = gc.open_by_url(SPREADSHEET_URL).sheet1
+    st.session_state.row_refs = None
+
+# Cliente autorizado, creado una vez por proceso
+@st.cache_resource
+def get_client():
+    return authorize(st.secrets["gcp_service_account"])
+
+# Hoja de trabajo, abierta una vez por proceso (la primera hoja si no se indica otra). Todas
+# las solicitudes pasan por InstrumentedWorksheet para contar lecturas y escrituras.
+@st.cache_resource
+def get_worksheet(url, worksheet=None):
+    return InstrumentedWorksheet(open_worksheet(get_client(), url, worksheet), get_metrics())
+
+# Métricas de rendimiento. Con METRICS_LOG=1 cada fase y cada solicitud a la API se
+# registra como una línea JSON en la salida estándar (para recolectarlas desde los logs).
+metrics_logger = logging.getLogger("estadoclientes.metrics")
+if not metrics_logger.handlers:
+    _handler = logging.StreamHandler()
+    _handler.setFormatter(logging.Formatter("%(message)s"))
+    metrics_logger.addHandler(_handler)
+    metrics_logger.propagate = False
+metrics_logger.setLevel(logging.INFO if os.environ.get("METRICS_LOG") == "1" else logging.WARNING)
+
+def log_metric(event, **fields):
+    if metrics_logger.isEnabledFor(logging.INFO):
+        ctx = get_script_run_ctx(suppress_warning=True)
+        fields["session"] = ctx.session_id if ctx else None
+        metrics_logger.info(json.dumps({"ts": time.time(), "event": event, **fields}, ensure_ascii=False))
+
+def session_counters():
+    """
+    Contadores de la API de la sesión actual, o None fuera de una ejecución de la app
+    (por ejemplo, en el hilo de escritura).
+    """
+    if get_script_run_ctx(suppress_warning=True) is None:
+        return None
+    if "api_counters" not in st.session_state:
+        st.session_state.api_counters = dict.fromkeys(ApiMetrics.KEYS, 0)
+    return st.session_state.api_counters
+
+class ApiMetrics:
+    """
+    Contadores de solicitudes y celdas a la API de Sheets de todo el proceso.
+    """
+    KEYS = ("read_requests", "read_cells", "write_requests", "write_cells", "queued_cells", "errors")
+    # Las escrituras las hace el hilo de la cola combinando celdas de todas las sesiones, así
+    # que solo se cuentan para el proceso (queued_cells es lo que encoló cada sesión)
+    PROCESS_ONLY = ("write_requests", "write_cells")
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = dict.fromkeys(self.KEYS, 0)
+        self.started = time.time()
+        self.local = threading.local()
 
-# Manejo de errores de API
-def handle_quota_error(e):
+    def add(self, **amounts):
+        counters = getattr(self.local, "counters", None)
+        if counters is None:
+            counters = session_counters()
+        with self.lock:
+            for key, amount in amounts.items():
+                self.counters[key] += amount
+                if counters is not None:
+                    counters[key] += amount
+
+    @contextlib.contextmanager
+    def attributed_to(self, counters):
+        """
+        Suma a `counters` lo que se registre en este hilo dentro del bloque, para los hilos
+        auxiliares que leen por cuenta de una sesión.
+        """
+        self.local.counters = counters
+        try:
+            yield
+        finally:
+            self.local.counters = None
+
+    def totals(self):
+        with self.lock:
+            return dict(self.counters)
+
+@st.cache_resource
+def get_metrics():
+    return ApiMetrics()
+
+class InstrumentedWorksheet:
+    """
+    Envuelve un gspread.Worksheet y registra en ApiMetrics cada lectura y escritura.
+    """
+    READS = ("get_all_values", "batch_get", "col_values")
+    WRITES = ("batch_update", "update_cells")
+
+    def __init__(self, worksheet, metrics):
+        self.worksheet = worksheet
+        self.metrics = metrics
+
+    def __getattr__(self, name):
+        attr = getattr(self.worksheet, name)
+        if name not in self.READS and name not in self.WRITES:
+            return attr
+
+        def call(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                result = attr(*args, **kwargs)
+            except Exception as e:
+                self.metrics.add(errors=1)
+                log_metric("sheets_api", method=name, error=str(e), ms=round((time.perf_counter() - start) * 1000, 1))
+                raise
+            if name in self.READS:
+                cells = count_read_cells(name, result)
+                self.metrics.add(read_requests=1, read_cells=cells)
+            else:
+                cells = count_written_cells(name, args[0] if args else kwargs.get("data", kwargs.get("cell_list", [])))
+                self.metrics.add(write_requests=1, write_cells=cells)
+            log_metric("sheets_api", method=name, cells=cells, ms=round((time.perf_counter() - start) * 1000, 1))
+            return result
+        return call
+
+def count_read_cells(method, result):
+    if method == "batch_get":
+        return sum(len(values) for value_range in result for values in value_range)
+    if method == "col_values":
+        return len(result)
+    return sum(len(row) for row in result)
+
+def count_written_cells(method, payload):
+    if method == "batch_update":
+        return sum(len(values) for update in payload for values in update["values"])
+    return len(payload)
+
+# Fases medidas en la última ejecución de la sesión (nombre -> ms)
+def timed_phase(phase):
+    """
+    Decorador que mide la duración de una fase y la guarda en la sesión y en los logs.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                elapsed = round((time.perf_counter() - start) * 1000, 1)
+                if get_script_run_ctx(suppress_warning=True) is not None:
+                    st.session_state.setdefault("perf_phases", {})[phase] = elapsed
+                log_metric("phase", phase=phase, ms=elapsed)
+        return wrapper
+    return decorator
+
+# Panel de depuración (se activa con ?debug=1 en la URL)
+def show_debug_sidebar():
+    with st.sidebar:
+        st.header("🔧 Rendimiento")
+        st.subheader("Última ejecución (ms)")
+        st.table({"Fase": list(st.session_state.get("perf_phases", {})),
+                  "ms": list(st.session_state.get("perf_phases", {}).values())})
+        st.subheader("API de Sheets")
+        session = session_counters() or {}
+        process = get_metrics().totals()
+        st.table({
+            "Métrica": list(ApiMetrics.KEYS),
+            "Sesión": ["—" if key in ApiMetrics.PROCESS_ONLY else str(session.get(key, 0)) for key in ApiMetrics.KEYS],
+            "Proceso": [process[key] for key in ApiMetrics.KEYS],
+        })
+        minutes = max((time.time() - get_metrics().started) / 60, 1 / 60)
+        st.caption(f"Escrituras por minuto (promedio del proceso): {process['write_requests'] / minutes:.1f} "
+                   f"de {WRITE_REQUESTS_PER_MINUTE} permitidas")
+        sheet = get_sheet()
+        queue = sheet.queue_status()
+        for shard in sheet.shards:
+            store = shard.store
+            st.caption(f"{shard.name} · versión de datos: {store.version} · filas: {len(store.data or [])} · "
+                       f"filas completas: {len(store.full_rows)}")
+        st.caption(f"Celdas en cola: {queue['pending'] + queue['in_flight']}")
+
+# Manejo de errores de API. No se vuelve a ejecutar la app: cada ejecución repetiría la
+# misma lectura y agotaría aún más la cuota.
+def show_api_error(e):
     error_str = str(e).lower()
     if "quota" in error_str or "limit" in error_str:
-        st.error("❌ Límite de API alcanzado. Reiniciando...")
-        time.sleep(1)
-        st.rerun()
+        st.error("❌ Límite de API alcanzado. Intente nuevamente en unos segundos.")
+    else:
+        st.error(f"❌ Error: {e}")
+
+# Segundos entre verificaciones de cambios en la planilla
+SYNC_INTERVAL = 60
+# Rangos por lectura de filas (los rangos van en la URL, que tiene un largo máximo)
+FETCH_RANGES_PER_REQUEST = 200
+# Segundos entre recargas completas (cubre ediciones manuales que no tocan la columna 32)
+FULL_REFRESH_INTERVAL = 15 * 60
+
+class SheetStore:
+    """
+    Copia local de la hoja, compartida entre sesiones y sincronizada de forma incremental.
+
+    Cada SYNC_INTERVAL se leen solo las columnas de cuenta y "Última Actualización". Si la
+    cantidad de filas cambió se recarga la hoja completa; si no, se vuelven a leer solo las
+    filas cuya cuenta o fecha cambió. Cada cambio incrementa `version`.
+
+    La carga completa trae solo las columnas de overview_columns(); las filas que se ven o
+    editan completas se piden bajo demanda con ensure_full_rows() y quedan en `full_rows`.
+
+    Las escrituras confirmadas se aplican directamente sobre la copia y su índice
+    (apply_cells), sin volver a leer la hoja.
+
+    Si existe una copia en disco (SnapshotFile), se sirve de inmediato al arrancar y la
+    recarga completa se hace en un hilo en segundo plano. Mientras los datos no estén
+    confirmados contra la planilla, stale_since() indica desde cuándo.
+    """
+
+    def __init__(self, open_worksheet, snapshot=None):
+        self.open_worksheet = open_worksheet
+        self.snapshot = snapshot
+        self.lock = threading.Lock()
+        self.data = None
+        self.index = None
+        self.full_rows = set()
+        self.version = 0
+        self.last_check = float("-inf")
+        self.last_full_load = float("-inf")
+        self.synced_at = None
+        self.last_error = None
+        self.from_snapshot = False
+        self.refreshing = False
+        saved = snapshot.load() if snapshot else None
+        if saved:
+            self.data, self.full_rows, self.index, self.synced_at = saved
+            self.from_snapshot = True
+            self.version += 1
+
+    @property
+    def worksheet(self):
+        return self.open_worksheet()
+
+    def current(self):
+        """
+        Retorna (data, index, version) sin consultar la planilla.
+        """
+        with self.lock:
+            return self.data, self.index, self.version
+
+    def sync(self):
+        """
+        Retorna (data, index, version), consultando la planilla solo si venció el intervalo.
+        """
+        with self.lock:
+            now = time.monotonic()
+            if self.data is None:
+                self._install_full(self._fetch_full())
+            elif now - self.last_full_load >= FULL_REFRESH_INTERVAL:
+                self._start_background_refresh()
+            elif now - self.last_check >= SYNC_INTERVAL and not self.refreshing:
+                self.last_check = now
+                try:
+                    self._delta_sync()
+                except Exception as e:
+                    self.last_error = str(e)
+                    raise
+                self.synced_at = chile_now()
+                self.last_error = None
+            return self.data, self.index, self.version
+
+    def stale_since(self):
+        """
+        Fecha de la última sincronización si los datos mostrados pueden estar desactualizados.
+        """
+        if self.from_snapshot or self.last_error:
+            return self.synced_at
+        return None
+
+    def apply_cells(self, cells):
+        """
+        Aplica celdas ya escritas en la planilla a la copia local y actualiza el índice.
+        Retorna [(fila, cuenta, sector, columna, anterior, nuevo)]; el valor anterior es None
+        si la fila no estaba completa y la columna no es de las proyectadas.
+        """
+        projected = set(overview_columns())
+        changes = []
+        with self.lock:
+            new_data = list(self.data)
+            copied = set()
+            reindex = False
+            for cell in cells:
+                if cell.row > len(new_data):
+                    continue
+                if cell.row not in copied:
+                    new_data[cell.row - 1] = list(new_data[cell.row - 1])
+                    copied.add(cell.row)
+                row = new_data[cell.row - 1]
+                if len(row) < cell.col:
+                    row.extend([""] * (cell.col - len(row)))
+                known = cell.row in self.full_rows or cell.col in projected
+                changes.append((cell.row, row[0], cell_value(row, 2), cell.col, row[cell.col - 1] if known else None, cell.value))
+                row[cell.col - 1] = cell.value
+                if cell.col <= 2:
+                    reindex = True
+                elif cell.col == LAST_UPDATE_COL and not reindex:
+                    self.index.record_update(row[0], parse_timestamp(cell.value))
+            self.data = new_data
+            if reindex:
+                self.index = SheetIndex(new_data)
+            self.version += 1
+            self._save(copied, reindexed=reindex)
+        return changes
+
+    def ensure_full_rows(self, row_numbers):
+        """
+        Garantiza que las filas indicadas tengan todas sus columnas y retorna los datos.
+        """
+        with self.lock:
+            missing = sorted(r for r in set(row_numbers) if r not in self.full_rows and r <= len(self.data))
+            if missing:
+                self._fetch_rows(missing)
+                self.version += 1
+                self._save(missing, reindexed=False)
+            return self.data
+
+    def check_conflicts(self, base, own=None):
+        """
+        Verificación optimista antes de escribir: lee solo la columna "Última Actualización"
+        de las filas de `base` ({fila: fecha sobre la que se hizo la edición}) y retorna las
+        que cambiaron en la planilla. Esas filas se vuelven a leer completas. Una fecha que
+        escribió este mismo proceso (`own`, {fila: fecha}) no cuenta como cambio ajeno.
+
+        Dos ediciones dentro del mismo minuto tienen la misma fecha y no se distinguen.
+        """
+        own = own or {}
+        rows = sorted(base)
+        runs = coalesce_runs(rows)
+        letter = column_letter(LAST_UPDATE_COL)
+        ranges = [f"{letter}{start}:{letter}{end}" for start, end in runs]
+        remote = {}
+        for i in range(0, len(ranges), FETCH_RANGES_PER_REQUEST):
+            fetched = self.worksheet.batch_get(ranges[i:i + FETCH_RANGES_PER_REQUEST])
+            for (start, end), values in zip(runs[i:i + FETCH_RANGES_PER_REQUEST], fetched):
+                for offset, row_number in enumerate(range(start, end + 1)):
+                    remote[row_number] = values[offset][0] if offset < len(values) and values[offset] else ""
+
+        conflicts = [r for r in rows if remote[r] != base[r] and remote[r] != own.get(r)]
+        if conflicts:
+            self.reload_rows(conflicts)
+        return conflicts
+
+    def reload_rows(self, row_numbers):
+        """
+        Vuelve a leer completas las filas indicadas y reconstruye el índice.
+        """
+        with self.lock:
+            rows = sorted(r for r in set(row_numbers) if r <= len(self.data))
+            if not rows:
+                return
+            self._fetch_rows(rows)
+            self.index = SheetIndex(self.data)
+            self.version += 1
+            self._save(rows)
+
+    def _start_background_refresh(self):
+        if self.refreshing:
+            return
+        self.refreshing = True
+        self.last_full_load = time.monotonic()
+        threading.Thread(target=self._background_refresh, name="sheet-refresh", daemon=True).start()
+
+    def _background_refresh(self):
+        try:
+            data = self._fetch_full()
+        except Exception as e:
+            with self.lock:
+                self.last_error = str(e)
+                self.refreshing = False
+                # Reintentar en el próximo intervalo de sincronización, no en cada rerun
+                self.last_full_load = time.monotonic() - FULL_REFRESH_INTERVAL + SYNC_INTERVAL
+            return
+        with self.lock:
+            self._install_full(data)
+            self.refreshing = False
+
+    def _fetch_full(self):
+        columns = overview_columns()
+        runs = coalesce_runs(columns)
+        ranges = [f"{column_letter(start)}:{column_letter(end)}" for start, end in runs]
+        fetched = self.worksheet.batch_get(ranges, major_dimension="COLUMNS")
+
+        # Las columnas no proyectadas quedan como "" (cadena compartida, sin costo de memoria)
+        n_rows = max((len(col) for block in fetched for col in block), default=0)
+        data = [[""] * SHEET_WIDTH for _ in range(n_rows)]
+        for (start, _), block in zip(runs, fetched):
+            for offset, values in enumerate(block):
+                col_index = start - 1 + offset
+                for i, value in enumerate(values):
+                    data[i][col_index] = value
+        return data
+
+    def _install_full(self, data):
+        self.data = data
+        self.full_rows = set()
+        self.index = SheetIndex(self.data)
+        self.version += 1
+        self.last_check = self.last_full_load = time.monotonic()
+        self.synced_at = chile_now()
+        self.last_error = None
+        self.from_snapshot = False
+        self._save()
+
+    def _save(self, row_numbers=None, reindexed=True):
+        if self.snapshot:
+            self.snapshot.save(self.data, self.full_rows, self.index, self.synced_at or chile_now(), row_numbers, reindexed)
+
+    def _fetch_rows(self, row_numbers):
+        """
+        Lee filas completas (en tramos contiguos, una solicitud por cada FETCH_RANGES_PER_REQUEST
+        tramos) y las reemplaza en la copia.
+        """
+        runs = coalesce_runs(row_numbers)
+        ranges = [f"A{start}:{rowcol_to_a1(end, SHEET_WIDTH)}" for start, end in runs]
+        fetched = []
+        for i in range(0, len(ranges), FETCH_RANGES_PER_REQUEST):
+            fetched.extend(self.worksheet.batch_get(ranges[i:i + FETCH_RANGES_PER_REQUEST]))
+
+        # Copia superficial: las sesiones que ya tienen la versión anterior no ven cambios a medias
+        new_data = list(self.data)
+        for (start, end), values in zip(runs, fetched):
+            for offset, row_number in enumerate(range(start, end + 1)):
+                row = list(values[offset]) if offset < len(values) else []
+                new_data[row_number - 1] = row + [""] * (SHEET_WIDTH - len(row))
+        self.data = new_data
+        self.full_rows.update(row_numbers)
+
+    def _delta_sync(self):
+        last_col = column_letter(LAST_UPDATE_COL)
+        cuentas, fechas = self.worksheet.batch_get(["A:A", f"{last_col}:{last_col}"], major_dimension="COLUMNS")
+        cuentas = cuentas[0] if cuentas else []
+        fechas = fechas[0] if fechas else []
+        # La API omite las celdas vacías al final de la columna A, y la copia llega hasta la
+        # columna proyectada más larga: se compara con la última fila que tiene cuenta
+        last_account = next((i + 1 for i in range(len(self.data) - 1, -1, -1) if self.data[i][0]), 0)
+        if len(cuentas) != last_account:
+            self._install_full(self._fetch_full())
+            return
+
+        changed = []
+        for i, row in enumerate(self.data):
+            cuenta = cuentas[i] if i < len(cuentas) else ""
+            fecha = fechas[i] if i < len(fechas) else ""
+            old_fecha = row[LAST_UPDATE_COL - 1] if len(row) >= LAST_UPDATE_COL else ""
+            if row[0] != cuenta or old_fecha != fecha:
+                changed.append(i + 1)
+        if not changed:
+            return
+
+        self._fetch_rows(changed)
+        self.index = SheetIndex(self.data)
+        self.version += 1
+        self._save(changed)
+
+class Shard:
+    """
+    Una planilla (u hoja) de origen, con su propia copia local, copia en disco y cola de
+    escrituras. El límite de escrituras por minuto (`bucket`) se comparte entre todas las
+    planillas. Las escrituras confirmadas quedan en el ChangeLog.
+    """
+
+    def __init__(self, name, url, worksheet=None, change_log=None, bucket=None):
+        self.name = name
+        self.url = url
+        self.change_log = change_log
+        open_sheet = lambda: get_worksheet(url, worksheet)
+        self.store = SheetStore(open_sheet, SnapshotFile(snapshot_path(url, worksheet), overview_columns()))
+        self.queue = WriteQueue(open_sheet, on_flush=self.flushed, on_failure=self.failed, bucket=bucket)
+
+    def flushed(self, cells):
+        changes = self.store.apply_cells(cells)
+        if self.change_log:
+            # Solo los campos que edita el usuario (las fechas se derivan de ellos)
+            labels = column_labels()
+            self.change_log.append([(cuenta, sector, self.name, row, col, old, new)
+                                    for row, cuenta, sector, col, old, new in changes
+                                    if col in labels and old != new])
+
+    def failed(self, rows):
+        # La planilla rechazó esas filas (por ejemplo, porque ya no existen): se vuelven a leer
+        self.store.reload_rows(rows)
+
+# Vistas combinadas recordadas para traducir números de fila de ejecuciones anteriores
+VIEW_HISTORY = 1024
+
+class ShardedSheet:
+    """
+    Vista combinada de una o más planillas de origen.
+
+    Las filas de cada planilla se concatenan (con un solo encabezado) en un único `data` con un
+    único índice, de modo que el resto de la app trabaja con números de fila globales. locate()
+    traduce un número global a su planilla y fila de origen; las lecturas completas, la
+    verificación de conflictos y las escrituras se reparten entre las planillas dueñas.
+
+    Los números globales dependen de la vista: si una planilla gana o pierde filas, las de las
+    planillas siguientes se desplazan. Por eso cada traducción indica la versión de la vista
+    en que se obtuvo el número, y lo que se guarda entre ejecuciones (la selección de la
+    sesión) son referencias estables (planilla, fila local) de refs().
+
+    Las planillas se sincronizan en paralelo y la vista se vuelve a armar solo cuando cambia la
+    versión de alguna. Con una sola planilla la vista es directamente su copia local.
+    """
+
+    def __init__(self, configs, change_log=None):
+        self.change_log = change_log
+        # Todas las planillas usan el mismo usuario de servicio y por lo tanto el mismo límite
+        bucket = TokenBucket(WRITE_REQUESTS_PER_MINUTE, WRITE_BURST)
+        self.shards = [Shard(**config, change_log=change_log, bucket=bucket) for config in configs]
+        self.pool = ThreadPoolExecutor(max_workers=len(self.shards), thread_name_prefix="sheet-sync")
+        self.lock = threading.Lock()
+        self.key = None
+        self.data = None
+        self.index = None
+        # Versión -> (desplazamiento, última fila global) de cada planilla en esa vista
+        self.views = {}
 
-# Obtener datos con caché
-@st.cache_data(ttl=60)
+    def sync(self):
+        """
+        Sincroniza todas las planillas y retorna (data, index, version) de la vista combinada.
+        `version` es la tupla de versiones de cada planilla.
+        """
+        return self._merge(self._map(self._sync_shard, self.shards))
+
+    def current(self):
+        return self._merge([shard.store.current() for shard in self.shards])
+
+    def ensure_full_rows(self, refs):
+        """
+        Garantiza que las filas referenciadas tengan todas sus columnas y retorna
+        (data, index, version) de la vista actual.
+        """
+        groups = {}
+        for i, local in refs:
+            groups.setdefault(self.shards[i], []).append(local)
+        self._map(lambda shard: shard.store.ensure_full_rows(groups[shard]), list(groups))
+        return self.current()
+
+    def check_conflicts(self, base, version, own=None):
+        """
+        Verifica conflictos en cada planilla dueña de las filas de `base` ({fila global: fecha})
+        y retorna las filas globales que cambiaron. `own` ({fila global: fecha}) son las fechas
+        que encoló la misma sesión.
+        """
+        own = own or {}
+        groups = self.split(base, version)
+
+        def check(shard):
+            rows = groups[shard]
+            conflicts = shard.store.check_conflicts({local: base[row] for local, row in rows.items()},
+                                                    {local: own.get(row) for local, row in rows.items()})
+            return [rows[local] for local in conflicts]
+
+        return sorted(itertools.chain.from_iterable(self._map(check, list(groups))))
+
+    def enqueue(self, cells, version):
+        """
+        Encola cada celda en la planilla dueña de su fila, con el número de fila local.
+        """
+        groups = {}
+        for cell in cells:
+            shard, local = self.locate(cell.row, version)
+            groups.setdefault(shard, []).append(Cell(local, cell.col, cell.value))
+        for shard, shard_cells in groups.items():
+            shard.queue.enqueue(shard_cells)
+
+    def queue_status(self):
+        """
+        Estado combinado de las colas de escritura (mismas claves que WriteQueue.status()).
+        """
+        statuses = [shard.queue.status() for shard in self.shards]
+        retries = [status["retry_in"] for status in statuses if status["retry_in"] is not None]
+        return {
+            "pending": sum(status["pending"] for status in statuses),
+            "in_flight": sum(status["in_flight"] for status in statuses),
+            "retry_in": max(retries) if retries else None,
+            "last_error": next((status["last_error"] for status in statuses if status["last_error"]), None),
+            "failed_rows": sum(status["failed_rows"] for status in statuses),
+            "flushed": sum(status["flushed"] for status in statuses),
+        }
+
+    def outstanding(self, cells, version):
+        """
+        Cuántas de las celdas dadas (con filas globales) siguen sin escribirse.
+        """
+        groups = {}
+        for cell in cells:
+            shard, local = self.locate(cell.row, version)
+            groups.setdefault(shard, []).append((local, cell.col))
+        return sum(shard.queue.outstanding(keys) for shard, keys in groups.items())
+
+    def failures(self, refs):
+        """
+        Errores de escritura de las filas referenciadas que se descartaron ({referencia: error}).
+        """
+        groups = {}
+        for i, local in refs:
+            groups.setdefault(i, []).append(local)
+        return {(i, local): error for i, rows in groups.items()
+                for local, error in self.shards[i].queue.failures(rows).items()}
+
+    def stale_since(self):
+        """
+        Fecha de sincronización más antigua entre las planillas desactualizadas.
+        """
+        stale = [since for since in (shard.store.stale_since() for shard in self.shards) if since]
+        return min(stale) if stale else None
+
+    def has_view(self, version):
+        return version in self.views
+
+    def _position(self, row_number, version):
+        offsets, _ = self.views[version]
+        # La fila 1 local de cada planilla es el encabezado
+        i = bisect.bisect_right([offset + 2 for offset in offsets], row_number) - 1
+        return i, row_number - offsets[i]
+
+    def locate(self, row_number, version):
+        """
+        Retorna (planilla, fila local) de un número de fila global de la vista `version`.
+        """
+        i, local = self._position(row_number, version)
+        return self.shards[i], local
+
+    def refs(self, row_numbers, version):
+        """
+        Referencias (índice de planilla, fila local) de filas globales de la vista `version`.
+        """
+        return [self._position(row_number, version) for row_number in row_numbers]
+
+    def rows(self, refs, version):
+        """
+        Filas globales de la vista `version` para las referencias dadas, en el mismo orden;
+        None si la fila ya no existe en su planilla.
+        """
+        offsets, ends = self.views[version]
+        return [offsets[i] + local if offsets[i] + local <= ends[i] else None for i, local in refs]
+
+    def split(self, row_numbers, version):
+        """
+        Agrupa filas globales por planilla: {planilla: {fila local: fila global}}.
+        """
+        groups = {}
+        for row_number in row_numbers:
+            shard, local = self.locate(row_number, version)
+            groups.setdefault(shard, {})[local] = row_number
+        return groups
+
+    def source_name(self, row_number, version):
+        return self.locate(row_number, version)[0].name
+
+    def _map(self, fn, items):
+        if len(items) == 1:
+            return [fn(items[0])]
+        # Las lecturas de los hilos del pool se cuentan en la sesión que las pidió
+        metrics, counters = get_metrics(), session_counters()
+
+        def run(item):
+            with metrics.attributed_to(counters):
+                return fn(item)
+
+        return list(self.pool.map(run, items))
+
+    @staticmethod
+    def _sync_shard(shard):
+        try:
+            return shard.store.sync()
+        except Exception:
+            # Una planilla que no responde sigue mostrando su última copia
+            if shard.store.data is None:
+                raise
+            return shard.store.current()
+
+    def _merge(self, results):
+        key = tuple(version for _, _, version in results)
+        with self.lock:
+            if key != self.key:
+                if len(results) == 1:
+                    self.data, self.index, _ = results[0]
+                    offsets, ends = [0], [len(self.data)]
+                else:
+                    data = [next((part[0] for part, _, _ in results if part), [])]
+                    offsets, ends = [], []
+                    for part, _, _ in results:
+                        offsets.append(len(data) - 1)
+                        data.extend(part[1:])
+                        ends.append(len(data))
+                    self.data = data
+                    self.index = SheetIndex.merged(
+                        [(index, offset) for (_, index, _), offset in zip(results, offsets)])
+                self.views[key] = (offsets, ends)
+                if len(self.views) > VIEW_HISTORY:
+                    del self.views[next(iter(self.views))]
+                self.key = key
+            return self.data, self.index, key
+
+@st.cache_resource
+def get_sheet():
+    return ShardedSheet(sheet_configs(st.secrets), ChangeLog(change_log_path()))
+
+# Obtener datos desde la copia local compartida
+@timed_phase("carga")
 def get_data():
+    sheet = get_sheet()
     try:
-        return sheet.get_all_values()
+        return sheet.sync()
     except Exception as e:
-        handle_quota_error(e)
-        st.error(f"❌ Error: {e}")
-        return None
+        show_api_error(e)
+        return None, None, None
 
-# Buscar filas según cuenta y sectores seleccionados
-def find_rows(selected_cuenta, selected_sectores, data):
-    rows = []
-    for i, row in enumerate(data[1:]):
-        match_cuenta = (row[0] == selected_cuenta)
-        match_sector = (len(selected_sectores) == 0 or row[1] in selected_sectores)
-        if match_cuenta and match_sector:
-            rows.append(i + 2)
-    return rows
-
-# Actualizar celdas (incluye actualización de cada proceso)
-def update_steps(rows, steps_updates, consultoria_value, comentarios_value):
-    now = get_chile_timestamp()
-    cells_to_update = []
+# Obtener las filas seleccionadas (referencias de ShardedSheet.refs) con todas sus columnas
+@timed_phase("filas completas")
+def get_full_rows(refs):
+    try:
+        return get_sheet().ensure_full_rows(refs)
+    except Exception as e:
+        show_api_error(e)
+        return None, None, None
+
+@timed_phase("índice y orden")
+def sorted_accounts(index, order):
+    return index.accounts(order)
 
-    # Actualizar Consultoría (columna 3)
-    consultoria_col = 3
-    update_consultoria = "" if consultoria_value == "Vacío" else consultoria_value
-    for row in rows:
-        cells_to_update.append(Cell(row, consultoria_col, update_consultoria))
+def row_changes(row, updates, now):
+    """
+    Compara los valores deseados ({columna: valor}) con una fila y retorna solo las celdas
+    que cambian. La fecha de un proceso se actualiza únicamente cuando cambia su estado, y
+    toda fila con cambios recibe la fecha de "Última Actualización".
+    """
+    date_cols = {p["step_col"]: p["date_col"] for p in processes}
+    changes = {}
+    for col, value in updates.items():
+        if cell_value(row, col) != value:
+            changes[col] = value
+            if col in date_cols:
+                changes[date_cols[col]] = now if value in DATED_STATES else ''
+    if changes:
+        changes[LAST_UPDATE_COL] = now
+    return changes
 
-    # Actualizar cada proceso (valor, observación y fecha)
+def build_changes(rows, data, steps_updates, consultoria_value, comentarios_value, now):
+    """
+    Aplica los mismos valores del formulario a cada fila y retorna las celdas que cambian.
+    """
+    updates = {CONSULTORIA_COL: "" if consultoria_value == "Vacío" else consultoria_value}
     for step in steps_updates:
-        selected_option = step["value"]
-        update_value = "" if selected_option == "Vacío" else selected_option
-        step_col = step["step_col"]
-        date_col = step["date_col"]
-        obs_col = step.get("obs_col")
-        for row in rows:
-            cells_to_update.append(Cell(row, step_col, update_value))
-            if obs_col is not None:
-                cells_to_update.append(Cell(row, obs_col, step["obs_value"]))
-            if update_value in ['Sí', 'Programado', 'Sí (DropControl)', 'Sí (CDTEC IF)', 'Sí (Ambas)']:
-                cells_to_update.append(Cell(row, date_col, now))
-            else:
-                cells_to_update.append(Cell(row, date_col, ''))
+        updates[step["step_col"]] = "" if step["value"] == "Vacío" else step["value"]
+        if step.get("obs_col") is not None:
+            updates[step["obs_col"]] = step["obs_value"]
+    updates[COMENTARIOS_COL] = comentarios_value
+
+    changes = []
+    for row_number in rows:
+        changed = row_changes(data[row_number - 1], updates, now)
+        changes.extend(Cell(row_number, col, value) for col, value in sorted(changed.items()))
+    return changes
+
+def coalesce_cells(cells):
+    """
+    Agrupa celdas contiguas en rangos A1 para un único batch_update. Las celdas seguidas de una
+    fila forman un tramo, y los tramos con las mismas columnas en filas consecutivas se unen en
+    un rectángulo.
+    """
+    runs = []
+    for cell in sorted(cells, key=lambda c: (c.row, c.col)):
+        last = runs[-1] if runs else None
+        if last and last["row"] == cell.row and last["end_col"] == cell.col - 1:
+            last["end_col"] = cell.col
+            last["values"].append(cell.value)
+        else:
+            runs.append({"row": cell.row, "start_col": cell.col, "end_col": cell.col, "values": [cell.value]})
+
+    blocks = []
+    open_blocks = {}
+    for run in runs:
+        key = (run["start_col"], run["end_col"])
+        block = open_blocks.get(key)
+        if block and block["end_row"] == run["row"] - 1:
+            block["end_row"] = run["row"]
+            block["values"].append(run["values"])
+        else:
+            block = {"start_row": run["row"], "end_row": run["row"], "start_col": run["start_col"],
+                     "end_col": run["end_col"], "values": [run["values"]]}
+            open_blocks[key] = block
+            blocks.append(block)
 
-    # Actualizar Comentarios generales (columna 31)
-    comentarios_col = 31
-    for row in rows:
-        cells_to_update.append(Cell(row, comentarios_col, comentarios_value))
+    return [
+        {
+            "range": f"{rowcol_to_a1(b['start_row'], b['start_col'])}:{rowcol_to_a1(b['end_row'], b['end_col'])}",
+            "values": b["values"],
+        }
+        for b in blocks
+    ]
 
-    # Actualizar fecha de última modificación (columna 32)
-    ultima_actualizacion_col = 32
-    for row in rows:
-        cells_to_update.append(Cell(row, ultima_actualizacion_col, now))
+# Límites de escritura de la API de Sheets (por usuario de servicio, por minuto)
+WRITE_REQUESTS_PER_MINUTE = 60
+WRITE_BURST = 10
+# Celdas por solicitud de escritura (las importaciones grandes se envían en varias partes)
+WRITE_CHUNK_CELLS = 5000
+# Espera máxima entre reintentos (segundos)
+MAX_BACKOFF = 64
+# Códigos HTTP que se reintentan (cuota y errores transitorios del servidor)
+RETRYABLE_CODES = (429, 500, 502, 503, 504)
 
+def is_retryable(e):
+    if isinstance(e, APIError):
+        return e.code in RETRYABLE_CODES
+    # Errores de red (requests y socket heredan de OSError)
+    return isinstance(e, OSError)
+
+class TokenBucket:
+    """
+    Limitador de tasa: `capacity` solicitudes en ráfaga, recargando `rate_per_minute` por minuto.
+    """
+
+    def __init__(self, rate_per_minute, capacity):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Bloquea hasta que haya un token disponible y lo consume.
+        """
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+class WriteQueue:
+    """
+    Cola de escrituras de una planilla, compartida por todas las sesiones del proceso.
+
+    Las celdas encoladas se combinan por (fila, columna), de modo que varias ediciones de las
+    mismas filas se envían una sola vez. Un hilo en segundo plano las envía con batch_update
+    en partes de hasta WRITE_CHUNK_CELLS celdas respetando el TokenBucket, y ante errores de
+    cuota reintenta con espera exponencial y jitter sin perder lo pendiente. Las colas de
+    varias planillas comparten un mismo `bucket`, ya que el límite es por usuario de servicio.
+
+    Una parte puede mezclar celdas de varias sesiones. Si la planilla la rechaza con un error
+    que no se reintenta, se divide por filas y se reenvía por mitades hasta aislar las filas
+    que fallan; solo esas se descartan y quedan en `failed_rows` ({fila: error}) hasta que se
+    escriban bien, para que cada sesión vea las fallas de sus propias filas.
+    """
+
+    def __init__(self, open_worksheet, on_flush=None, on_failure=None, bucket=None):
+        self.open_worksheet = open_worksheet
+        self.on_flush = on_flush
+        self.on_failure = on_failure
+        self.bucket = bucket or TokenBucket(WRITE_REQUESTS_PER_MINUTE, WRITE_BURST)
+        self.cond = threading.Condition()
+        self.pending = {}
+        # Celdas (fila, columna) de la parte que se está enviando
+        self.in_flight = set()
+        self.retries = 0
+        self.retry_at = None
+        self.last_error = None
+        # Partes rechazadas que se reenvían divididas, antes que lo pendiente
+        self.isolating = []
+        self.failed_rows = {}
+        self.flushed_cells = 0
+        self.thread = threading.Thread(target=self._run, name="sheet-writer", daemon=True)
+        self.thread.start()
+
+    @property
+    def worksheet(self):
+        return self.open_worksheet()
+
+    def enqueue(self, cells):
+        with self.cond:
+            for cell in cells:
+                self.pending[(cell.row, cell.col)] = cell.value
+                # Un nuevo intento reemplaza la falla anterior de la fila
+                self.failed_rows.pop(cell.row, None)
+            self.cond.notify()
+
+    def outstanding(self, keys):
+        """
+        Cuántas de las celdas (fila, columna) dadas siguen en cola o enviándose.
+        """
+        with self.cond:
+            return sum(1 for key in keys
+                       if key in self.pending or key in self.in_flight or any(key in part for part in self.isolating))
+
+    def failures(self, rows):
+        """
+        Errores de las filas dadas cuyas celdas se descartaron ({fila: error}).
+        """
+        with self.cond:
+            return {row: self.failed_rows[row] for row in rows if row in self.failed_rows}
+
+    def status(self):
+        with self.cond:
+            return {
+                "pending": len(self.pending) + sum(len(part) for part in self.isolating),
+                "in_flight": len(self.in_flight),
+                "retry_in": max(0, round(self.retry_at - time.time())) if self.retry_at else None,
+                "last_error": self.last_error,
+                "failed_rows": len(self.failed_rows),
+                "flushed": self.flushed_cells,
+            }
+
+    def _isolate(self, batch, error):
+        """
+        Divide una parte rechazada en dos mitades por fila para reenviarlas; una fila sola que
+        falla se descarta, queda registrada y se retorna.
+        """
+        rows = sorted({row for row, _ in batch})
+        if len(rows) == 1:
+            self.failed_rows[rows[0]] = error
+            return rows[0]
+        middle = rows[len(rows) // 2]
+        self.isolating.append({key: value for key, value in batch.items() if key[0] >= middle})
+        self.isolating.append({key: value for key, value in batch.items() if key[0] < middle})
+        return None
+
+    def _run(self):
+        while True:
+            with self.cond:
+                while not self.pending and not self.isolating:
+                    self.cond.wait()
+            self.bucket.acquire()
+            with self.cond:
+                if self.isolating:
+                    batch = self.isolating.pop()
+                else:
+                    # Ordenadas por fila y columna, para que cada parte forme rangos contiguos
+                    keys = sorted(self.pending)[:WRITE_CHUNK_CELLS]
+                    batch = {key: self.pending.pop(key) for key in keys}
+                self.in_flight = set(batch)
+            cells = [Cell(row, col, value) for (row, col), value in batch.items()]
+            try:
+                self.worksheet.batch_update(coalesce_cells(cells), value_input_option='USER_ENTERED')
+            except Exception as e:
+                if not is_retryable(e):
+                    with self.cond:
+                        self.in_flight = set()
+                        failed = self._isolate(batch, str(e))
+                    if failed is not None:
+                        self._notify(self.on_failure, [failed])
+                    continue
+                with self.cond:
+                    self.in_flight = set()
+                    # Lo encolado durante el envío es más reciente y tiene prioridad
+                    for key, value in batch.items():
+                        self.pending.setdefault(key, value)
+                    self.retries += 1
+                    self.last_error = str(e)
+                    delay = min(MAX_BACKOFF, 2 ** self.retries) + random.uniform(0, 1)
+                    self.retry_at = time.time() + delay
+                time.sleep(delay)
+                continue
+            with self.cond:
+                self.in_flight = set()
+                self.flushed_cells += len(batch)
+                self.retries = 0
+                self.retry_at = None
+                self.last_error = None
+                for row, _ in batch:
+                    self.failed_rows.pop(row, None)
+            self._notify(self.on_flush, cells)
+
+    @staticmethod
+    def _notify(callback, arg):
+        if not callback:
+            return
+        try:
+            callback(arg)
+        except Exception:
+            # Un fallo al actualizar la copia local o el registro no debe detener la cola
+            logging.getLogger("estadoclientes").exception("Error al procesar el resultado de una escritura")
+
+# Estado de la cola de escrituras (se refresca solo mientras la página está abierta)
+@st.fragment(run_every=2)
+def show_write_status():
+    sheet = get_sheet()
+    status = sheet.queue_status()
+    pending = status["pending"] + status["in_flight"]
+    # Solo las fallas de las filas que encoló esta sesión; dejan de contarse como propias
+    own_stamps = st.session_state.get("own_stamps", {})
+    failures = sheet.failures(list(own_stamps)) if own_stamps else {}
+    if failures:
+        for ref in failures:
+            own_stamps.pop(ref, None)
+        st.session_state.setdefault("write_failures", {}).update(failures)
+    write_failures = st.session_state.get("write_failures")
+    if write_failures:
+        st.error(f"❌ No se pudieron guardar los cambios de {len(write_failures)} sector(es): "
+                 f"{next(iter(write_failures.values()))}")
+        if st.button("Entendido", key="dismiss_write_failures"):
+            st.session_state.pop("write_failures")
+            st.rerun(scope="fragment")
+    if pending and status["last_error"]:
+        st.warning(f"⏳ {pending} celda(s) pendientes. Límite de API alcanzado, reintentando en {status['retry_in']} s.")
+    elif pending:
+        st.info(f"⏳ Guardando {pending} celda(s)...")
+
+def enqueue_cells(cells, version):
+    sheet = get_sheet()
+    sheet.enqueue(cells, version)
+    get_metrics().add(queued_cells=len(cells))
+    # Fechas encoladas por esta sesión: al volver a guardar las mismas filas no son de otra persona
+    stamps = [c for c in cells if c.col == LAST_UPDATE_COL]
+    own_stamps = st.session_state.setdefault("own_stamps", {})
+    own_stamps.update(zip(sheet.refs([c.row for c in stamps], version), (c.value for c in stamps)))
+
+def save_cells(cells, data, version):
+    """
+    Encola las celdas tras verificar que nadie más modificó esas filas. Las filas en conflicto
+    no se encolan: quedan en st.session_state.conflict para que el usuario decida en
+    show_conflict_prompt(). Retorna la lista de filas en conflicto.
+
+    Las filas de `cells` son números globales de la vista `version` de `data`, los datos sobre
+    los que se calcularon los cambios. La fecha base se toma de ellos: la copia compartida ya
+    puede incluir lo que guardó otra sesión del mismo proceso. Las fechas que encoló esta misma
+    sesión no cuentan como cambio ajeno.
+    """
+    sheet = get_sheet()
+    if not sheet.has_view(version):
+        st.error("❌ Los datos cambiaron mientras editaba. Vuelva a buscar el registro antes de guardar.")
+        return []
+    rows = sorted({c.row for c in cells})
+    base = {row: cell_value(data[row - 1], LAST_UPDATE_COL) for row in rows}
+    own_stamps = st.session_state.get("own_stamps", {})
+    own = {row: own_stamps[ref] for row, ref in zip(rows, sheet.refs(rows, version)) if ref in own_stamps}
     try:
-        sheet.update_cells(cells_to_update, value_input_option='USER_ENTERED')
-        st.success("✅ Cambios guardados.")
-        st.cache_data.clear()
-        return True
+        conflicts = set(sheet.check_conflicts(base, version, own))
     except Exception as e:
-        handle_quota_error(e)
-        st.error(f"❌ Error: {e}")
+        # Sin verificación igual se guarda: la cola ya maneja los límites de la API
+        st.warning(f"⚠️ No se pudo verificar si otra persona modificó estos sectores. ({e})")
+        conflicts = set()
+    safe = [c for c in cells if c.row not in conflicts]
+    if safe:
+        enqueue_cells(safe, version)
+    if conflicts:
+        # Con referencias estables: el aviso se muestra en una ejecución posterior, con otra vista
+        pending = [c for c in cells if c.row in conflicts]
+        refs = sheet.refs([c.row for c in pending], version)
+        st.session_state.conflict = [(ref, c.col, c.value) for ref, c in zip(refs, pending)]
+    return sorted(conflicts)
+
+def column_labels():
+    labels = {CONSULTORIA_COL: "Consultoría", COMENTARIOS_COL: "Comentarios generales"}
+    for proc in processes:
+        labels[proc["step_col"]] = proc["name"]
+        labels[proc["obs_col"]] = f"Observaciones - {proc['name']}"
+    return labels
+
+# Aviso de conflicto: otra persona modificó filas que el usuario intentó guardar
+def show_conflict_prompt(data, data_version):
+    conflict = st.session_state.get("conflict")
+    if not conflict:
+        return
+    rows = get_sheet().rows([ref for ref, _, _ in conflict], data_version)
+    cells = [Cell(row, col, value) for row, (_, col, value) in zip(rows, conflict) if row is not None]
+    labels = column_labels()
+    shown = [c for c in cells if c.col in labels and cell_value(data[c.row - 1], c.col) != c.value]
+    st.warning(f"⚠️ Otra persona modificó {len({c.row for c in cells})} sector(es) mientras usted editaba. "
+               "Revise los valores actuales antes de guardar.")
+    st.dataframe({
+        "Cuenta / Sector": [f"{cell_value(data[c.row - 1], 1)} / {cell_value(data[c.row - 1], 2)}" for c in shown],
+        "Campo": [labels[c.col] for c in shown],
+        "En la planilla ahora": [cell_value(data[c.row - 1], c.col) for c in shown],
+        "Sus cambios": [c.value for c in shown],
+    }, hide_index=True, use_container_width=True)
+    col1, col2 = st.columns(2)
+    if col1.button("Sobrescribir con mis cambios", type="primary", use_container_width=True):
+        st.session_state.pop("conflict")
+        enqueue_cells(cells, data_version)
+        st.rerun()
+    if col2.button("Mantener los valores de la planilla", use_container_width=True):
+        st.session_state.pop("conflict")
+        st.rerun()
+
+# Actualizar celdas (solo las que cambiaron respecto de los datos cargados)
+@timed_phase("guardar")
+def update_steps(rows, data, version, steps_updates, consultoria_value, comentarios_value):
+    now = get_chile_timestamp()
+    cells_to_update = build_changes(rows, data, steps_updates, consultoria_value, comentarios_value, now)
+    if not cells_to_update:
+        st.info("ℹ️ No hay cambios para guardar.")
         return False
 
+    save_cells(cells_to_update, data, version)
+    return True
+
 # Obtener color según estado
 def get_state_color(state):
     colors = {
@@ -128,360 +1145,830 @@ def get_state_color(state):
     }
     return colors.get(state, '#E0E0E0')
 
-# Definición centralizada de procesos.
-processes = [
-    {"name": "Proceso Nuevo 1", "step_col": 4, "obs_col": 5, "date_col": 6, "options": ['Sí', 'No', 'Programado']},
-    {"name": "Proceso Nuevo 2", "step_col": 7, "obs_col": 8, "date_col": 9, "options": ['Sí', 'No', 'Programado']},
-    {"name": "Ingreso a Planilla Clientes Nuevos", "step_col": 10, "obs_col": 11, "date_col": 12, "options": ['Sí', 'No']},
-    {"name": "Correo Presentación y Solicitud Información", "step_col": 13, "obs_col": 14, "date_col": 15, "options": ['Sí', 'No', 'Programado']},
-    {"name": "Agregar Puntos Críticos", "step_col": 16, "obs_col": 17, "date_col": 18, "options": ['Sí', 'No']},
-    {"name": "Generar Capacitación Plataforma", "step_col": 19, "obs_col": 20, "date_col": 21, "options": ['Sí (DropControl)', 'Sí (CDTEC IF)', 'Sí (Ambas)', 'No', 'Programado']},
-    {"name": "Generar Documento Power BI", "step_col": 22, "obs_col": 23, "date_col": 24, "options": ['Sí', 'No', 'Programado', 'No aplica']},
-    {"name": "Generar Capacitación Power BI", "step_col": 25, "obs_col": 26, "date_col": 27, "options": ['Sí', 'No', 'Programado', 'No aplica']},
-    {"name": "Generar Estrategia de Riego", "step_col": 28, "obs_col": 29, "date_col": 30, "options": ['Sí', 'No', 'Programado', 'No aplica']}
-]
+# Filas por página en la tabla de estado (evita enviar iframes enormes al navegador)
+STATUS_PAGE_SIZE = 50
 
-def main():
-    st.title("📌 Registro de Procesos")
-    
-    # Botón para abrir la planilla de Google
-    html_button = f"""
-    <div style="text-align: left; margin-bottom: 10px;">
-        <a href="{SPREADSHEET_URL}" target="_blank">
-            <button style="
-                background-color: #4CAF50;
-                color: white;
-                border: none;
-                padding: 5px 10px;
-                text-align: center;
-                text-decoration: none;
-                display: inline-block;
-                font-size: 14px;
-                border-radius: 5px;
-                cursor: pointer;">
-                Abrir Planilla de Google
-            </button>
-        </a>
-    </div>
+STATUS_TABLE_STYLE = """
+<style>
+.status-table {
+    width: 100%;
+    border-collapse: collapse;
+    font-family: -apple-system, BlinkMacSystemFont, "Segoe UI", Roboto, Helvetica, Arial, sans-serif;
+}
+.status-table th, .status-table td {
+    border: 1px solid #ddd;
+    padding: 8px;
+    text-align: center;
+}
+.status-table th {
+    background-color: #f2f2f2;
+    position: sticky;
+    top: 0;
+}
+.status-table tr:nth-child(even) {
+    background-color: #f9f9f9;
+}
+.status-cell {
+    border-radius: 4px;
+    color: white;
+    padding: 4px 8px;
+    display: inline-block;
+    width: 90%;
+    text-align: center;
+}
+.date-cell {
+    font-size: 0.85em;
+    color: #333;
+}
+</style>
+"""
+
+@functools.lru_cache(maxsize=None)
+def status_cell_html(value):
     """
-    components.html(html_button, height=50)
+    Celda coloreada para un estado (memorizada: hay pocos estados distintos).
+    """
+    state = value if value and value.strip() != "" else "Vacío"
+    color = get_state_color(state)
+    return f'<td><div class="status-cell" style="background-color: {color};">{html.escape(state)}</div></td>'
 
-    # Inicializar estado de actualizaciones
-    if "update_successful" not in st.session_state:
-        st.session_state.update_successful = False
+# Tabla HTML de estado, memorizada por versión de los datos y filas mostradas. Con varias
+# planillas, `sources` trae el nombre de la planilla de origen de cada fila.
+@st.cache_data(max_entries=64)
+def render_status_table(_data, data_version, rows, height, sources=None):
+    headers = ["Cuenta", "Sector", "Consultoría"] + [p["name"] for p in processes] + ["Última Actualización"]
+    selected = [_data[r - 1] for r in rows]
 
-    # Cargar datos (se recargan si hubo una actualización exitosa)
-    if "data" not in st.session_state or st.session_state.update_successful:
-        st.session_state.data = get_data()
-        st.session_state.update_successful = False
-    data = st.session_state.data
+    # Se arma por columnas y se une una sola vez al final
+    columns = [
+        [f"<td>{html.escape(row[0])}</td>" for row in selected],
+        [f"<td>{html.escape(cell_value(row, 2))}</td>" for row in selected],
+    ]
+    if sources:
+        headers.insert(2, "Planilla")
+        columns.append([f"<td>{html.escape(source)}</td>" for source in sources])
+    for col in [CONSULTORIA_COL] + [p["step_col"] for p in processes]:
+        columns.append([status_cell_html(cell_value(row, col)) for row in selected])
+    columns.append([f'<td><div class="date-cell">{html.escape(cell_value(row, LAST_UPDATE_COL))}</div></td>' for row in selected])
 
-    if data is None:
-        st.stop()
+    header_html = "".join(f"<th>{h}</th>" for h in headers)
+    body_html = "".join(f"<tr>{''.join(cells)}</tr>" for cells in zip(*columns))
+    return (
+        f'{STATUS_TABLE_STYLE}<div style="height: {height}px; overflow-y: auto;">'
+        f'<table class="status-table"><thead><tr>{header_html}</tr></thead>'
+        f'<tbody>{body_html}</tbody></table></div>'
+    )
 
-    st.header("Buscar Registro")
-    
-    # Filtro para ordenar las cuentas
-    order_options = ["Más recientes primero", "Más antiguos primero", "Orden alfabético"]
-    selected_order = st.radio("Ordenar cuentas", order_options, index=0, horizontal=True)
-    
-    # Extraer las cuentas únicas (sin ordenar aún)
-    unique_cuentas_set = set(row[0] for row in data[1:])
-    unique_cuentas = list(unique_cuentas_set)
-    
-    # Obtener la última actualización para cada cuenta (columna 32, índice 31)
-    cuenta_updates = {}
-    for row in data[1:]:
-        cuenta = row[0]
-        if len(row) > 31:
-            date_str = row[31]
-            if date_str and date_str.strip() != "" and date_str != "Vacío":
-                try:
-                    dt = datetime.strptime(date_str, '%d-%m-%y %H:%M')
-                except Exception:
-                    dt = None
-                if dt:
-                    if cuenta in cuenta_updates:
-                        if dt > cuenta_updates[cuenta]:
-                            cuenta_updates[cuenta] = dt
-                    else:
-                        cuenta_updates[cuenta] = dt
-                        
-    # Ordenar la lista de cuentas según la opción seleccionada
-    if selected_order == "Más recientes primero":
-        unique_cuentas.sort(key=lambda acc: cuenta_updates.get(acc, datetime.min), reverse=True)
-    elif selected_order == "Más antiguos primero":
-        unique_cuentas.sort(key=lambda acc: cuenta_updates.get(acc, datetime.min))
-    elif selected_order == "Orden alfabético":
-        unique_cuentas.sort(key=lambda acc: acc.lower())
-    
-    # Mostrar el selectbox con las cuentas ordenadas
-    cuentas_options = ["Seleccione una cuenta"] + unique_cuentas
-    selected_cuenta = st.selectbox("Cuenta", cuentas_options, key="cuenta", on_change=reset_search)
-    
+# Umbral de sectores a partir del cual se usa un multiselect con búsqueda en vez de checkboxes
+SECTOR_CHECKBOX_LIMIT = 30
+
+# Botones "Seleccionar/Deseleccionar Todos": se ejecuta antes de la siguiente ejecución,
+# cuando todavía se puede asignar el valor de los widgets (el multiselect o cada checkbox)
+def set_selected_sectores(unique_sectores, selected, multiselect_key=None):
+    st.session_state.selected_sectores = list(selected)
+    if multiselect_key:
+        st.session_state[multiselect_key] = list(selected)
+    else:
+        for sector in unique_sectores:
+            st.session_state[f"sector_{sector}"] = sector in selected
+
+# Selección de sectores y búsqueda. Se vuelve a ejecutar por sí sola al marcar sectores.
+@st.fragment
+@timed_phase("sectores")
+def sector_picker(index, selected_cuenta, data_version):
     # Selección múltiple de Sectores (si se selecciona una cuenta válida)
     if selected_cuenta != "Seleccione una cuenta":
-        sectores_para_cuenta = [row[1] for row in data[1:] if row[0] == selected_cuenta]
-        unique_sectores = sorted(set(sectores_para_cuenta))
+        unique_sectores = index.sectors_for(selected_cuenta)
         
         if "selected_sectores" not in st.session_state:
             st.session_state.selected_sectores = []
 
-        st.write("Sectores de Riego (seleccione uno o varios):")
-        import math
-        if len(unique_sectores) > 20:
-            col_count = 3
-        elif len(unique_sectores) > 10:
-            col_count = 2
+        # El multiselect guarda su selección en su propia clave (por cuenta); usar `default`
+        # cambiaría su identidad en cada ejecución y descartaría la selección del usuario
+        multiselect_key = None
+        if len(unique_sectores) > SECTOR_CHECKBOX_LIMIT:
+            multiselect_key = f"sector_multiselect_{selected_cuenta}"
+            if multiselect_key not in st.session_state:
+                st.session_state[multiselect_key] = [s for s in st.session_state.selected_sectores if s in unique_sectores]
+            st.multiselect(
+                "Sectores de Riego (escriba para buscar, seleccione uno o varios):",
+                unique_sectores,
+                key=multiselect_key,
+            )
+            st.session_state.selected_sectores = list(st.session_state[multiselect_key])
         else:
-            col_count = 1
-
-        columns = st.columns(col_count)
-        chunk_size = math.ceil(len(unique_sectores) / col_count)
-        sectors_chunks = [unique_sectores[i:i+chunk_size] for i in range(0, len(unique_sectores), chunk_size)]
-        for idx, chunk in enumerate(sectors_chunks):
-            with columns[idx]:
-                for sector in chunk:
-                    sector_checked = st.checkbox(
-                        sector,
-                        key=f"sector_{sector}",
-                        value=sector in st.session_state.selected_sectores
-                    )
-                    if sector_checked and sector not in st.session_state.selected_sectores:
-                        st.session_state.selected_sectores.append(sector)
-                    elif not sector_checked and sector in st.session_state.selected_sectores:
-                        st.session_state.selected_sectores.remove(sector)
-        if st.button("Seleccionar Todos", use_container_width=True):
-            st.session_state.selected_sectores = unique_sectores.copy()
-            st.rerun()
-        if st.button("Deseleccionar Todos", use_container_width=True):
-            st.session_state.selected_sectores = []
-            st.rerun()
+            st.write("Sectores de Riego (seleccione uno o varios):")
+            if len(unique_sectores) > 20:
+                col_count = 3
+            elif len(unique_sectores) > 10:
+                col_count = 2
+            else:
+                col_count = 1
+
+            columns = st.columns(col_count)
+            chunk_size = max(1, math.ceil(len(unique_sectores) / col_count))
+            sectors_chunks = [unique_sectores[i:i+chunk_size] for i in range(0, len(unique_sectores), chunk_size)]
+            for idx, chunk in enumerate(sectors_chunks):
+                with columns[idx]:
+                    for sector in chunk:
+                        checkbox_key = f"sector_{sector}"
+                        if checkbox_key not in st.session_state:
+                            st.session_state[checkbox_key] = sector in st.session_state.selected_sectores
+                        sector_checked = st.checkbox(sector, key=checkbox_key)
+                        if sector_checked and sector not in st.session_state.selected_sectores:
+                            st.session_state.selected_sectores.append(sector)
+                        elif not sector_checked and sector in st.session_state.selected_sectores:
+                            st.session_state.selected_sectores.remove(sector)
+        st.button("Seleccionar Todos", use_container_width=True,
+                  on_click=set_selected_sectores, args=(unique_sectores, unique_sectores, multiselect_key))
+        st.button("Deseleccionar Todos", use_container_width=True,
+                  on_click=set_selected_sectores, args=(unique_sectores, [], multiselect_key))
     else:
         st.session_state.selected_sectores = []
 
-    # Botón para buscar el registro
+    # Botón para buscar el registro. Cambiar las filas afecta a las pestañas, por lo que
+    # la búsqueda vuelve a ejecutar la app completa y el resultado se muestra después.
     if st.button("Buscar Registro", type="primary", use_container_width=True):
+        feedback = []
         if selected_cuenta == "Seleccione una cuenta":
-            st.error("❌ Seleccione una cuenta válida.")
-            st.session_state.rows = None
+            feedback.append(("error", "❌ Seleccione una cuenta válida."))
+            rows = []
         elif not st.session_state.selected_sectores:
-            st.warning("⚠️ No hay sectores seleccionados. Se mostrarán todos los sectores para esta cuenta.")
-            rows = find_rows(selected_cuenta, [], data)
-            if not rows:
-                st.error("❌ No se encontraron registros.")
-                st.session_state.rows = None
-            else:
-                st.session_state.rows = rows
-                st.success(f"Se actualizarán {len(rows)} sector(es).")
+            feedback.append(("warning", "⚠️ No hay sectores seleccionados. Se mostrarán todos los sectores para esta cuenta."))
+            rows = find_rows(selected_cuenta, [], index)
         else:
-            rows = find_rows(selected_cuenta, st.session_state.selected_sectores, data)
+            rows = find_rows(selected_cuenta, st.session_state.selected_sectores, index)
+        if selected_cuenta != "Seleccione una cuenta":
             if not rows:
-                st.error("❌ No se encontraron registros.")
-                st.session_state.rows = None
+                feedback.append(("error", "❌ No se encontraron registros."))
             else:
-                st.session_state.rows = rows
-                st.success(f"Se actualizarán {len(rows)} sector(es).")
+                feedback.append(("success", f"Se actualizarán {len(rows)} sector(es)."))
+        # Se guardan referencias estables: los números globales cambian con las planillas
+        st.session_state.row_refs = get_sheet().refs(rows, data_version) if rows else None
+        st.session_state.search_feedback = feedback
+        st.rerun(scope="app")
+
+    for kind, message in st.session_state.pop("search_feedback", []):
+        getattr(st, kind)(message)
+
+# Pestaña "Estado Actual": tabla de estado y observaciones
+@st.fragment
+@timed_phase("tabla de estado")
+def status_tab(data, data_version, rows):
+    st.header("Procesos")
+    table_rows = rows
+    n_pages = -(-len(table_rows) // STATUS_PAGE_SIZE)
+    if n_pages > 1:
+        page = st.number_input(f"Página (de {n_pages})", min_value=1, max_value=n_pages, value=1, step=1, key="status_page")
+        table_rows = table_rows[(page - 1) * STATUS_PAGE_SIZE:page * STATUS_PAGE_SIZE]
+
+    n_rows = len(table_rows)
+    if n_rows <= 3:
+        estado_height = 230
+    elif n_rows <= 10:
+        estado_height = 285
+    else:
+        estado_height = 500
+
+    sheet = get_sheet()
+    sources = tuple(sheet.source_name(r, data_version) for r in table_rows) if len(sheet.shards) > 1 else None
+    html_table = render_status_table(data, data_version, tuple(table_rows), estado_height, sources)
+    st.components.v1.html(html_table, height=estado_height)
+
+    st.subheader("Observaciones")
+    # Extraer los sectores presentes en las filas seleccionadas
+    sectores_observ = []
+    for r in rows:
+        if len(data[r-1]) > 1:
+            sectores_observ.append(data[r-1][1])
+    sectores_observ = sorted(set(sectores_observ))
+    if len(sectores_observ) > 1:
+        chosen_sector = st.selectbox("Seleccione el sector para ver observaciones:", sectores_observ, key="observ_sector_select")
+        chosen_row = None
+        for r in rows:
+            if data[r-1][1] == chosen_sector:
+                chosen_row = r
+                break
+        if chosen_row is None:
+            st.error("No se encontró la fila para el sector seleccionado.")
+            fila_datos = None
+        else:
+            fila_datos = data[chosen_row - 1]
+    else:
+        fila_datos = data[rows[0] - 1]
+
+    if fila_datos:
+        general_comment = fila_datos[30] if len(fila_datos) > 30 and fila_datos[30].strip() != "" else "Vacío"
+        with st.expander("Comentarios Generales", expanded=True):
+            st.write(general_comment)
+        for proc in processes:
+            obs_index = proc["obs_col"] - 1
+            obs_value = fila_datos[obs_index] if len(fila_datos) > obs_index and fila_datos[obs_index].strip() != "" else "Vacío"
+            with st.expander(proc["name"], expanded=True):
+                st.write(obs_value)
+
+# Pestaña "Actualizar Registro": formulario aplicado a todas las filas seleccionadas
+@st.fragment
+@timed_phase("formulario")
+def update_form(data, rows, version):
+    st.header("Actualizar Registro")
+    fila_index = rows[0] - 1
+    fila_datos = data[fila_index]
+
+    # Campo de Consultoría
+    consultoria_default = fila_datos[2] if len(fila_datos) >= 3 else ""
+    display_consultoria = consultoria_default.strip() if consultoria_default and consultoria_default.strip() != "" else "Vacío"
+    consultoria_options = ["Sí", "No"]
+    if display_consultoria not in consultoria_options:
+        consultoria_options = [display_consultoria] + consultoria_options
+    try:
+        consultoria_index = consultoria_options.index(display_consultoria)
+    except ValueError:
+        consultoria_index = 0
+    consultoria_value = st.selectbox("Consultoría", options=consultoria_options, index=consultoria_index, key="consultoria_update")
+
+    # Dividir en dos columnas: valores y observaciones de cada proceso
+    col1, col2 = st.columns(2)
+
+    # Columna 1: Valores de cada proceso
+    process_values = {}
+    with col1:
+        for i, proc in enumerate(processes):
+            default_val = fila_datos[proc["step_col"] - 1] if len(fila_datos) >= proc["step_col"] else ""
+            display_val = default_val.strip() if default_val and default_val.strip() != "" else "Vacío"
+            options_for_select = proc["options"].copy()
+            if display_val not in options_for_select:
+                options_for_select = [display_val] + options_for_select
+            default_index = options_for_select.index(display_val)
+            process_values[proc["name"]] = st.selectbox(
+                proc["name"],
+                options=options_for_select,
+                index=default_index,
+                key=f"process_{i}_update"
+            )
+
+    # Columna 2: Observaciones de cada proceso y comentarios generales
+    process_obs_values = {}
+    with col2:
+        for i, proc in enumerate(processes):
+            default_obs = fila_datos[proc["obs_col"] - 1] if len(fila_datos) >= proc["obs_col"] else ""
+            process_obs_values[proc["name"]] = st.text_area(
+                f"Observaciones - {proc['name']}",
+                value=default_obs,
+                height=68,
+                key=f"obs_{i}_update"
+            )
+        comentarios_default = fila_datos[COMENTARIOS_COL - 1] if len(fila_datos) >= COMENTARIOS_COL else ""
+        comentarios_generales = st.text_area("Comentarios generales", value=comentarios_default, height=68, key="comentarios_generales_update")
+
+    # Botón de guardar cambios con el estilo deseado
+    if st.button("Guardar Cambios", type="primary", use_container_width=True):
+        steps_updates = []
+        for proc in processes:
+            steps_updates.append({
+                "step_label": proc["name"],
+                "step_col": proc["step_col"],
+                "obs_col": proc["obs_col"],
+                "date_col": proc["date_col"],
+                "value": process_values[proc["name"]],
+                "obs_value": process_obs_values[proc["name"]]
+            })
+        comentarios_generales_value = st.session_state.get("comentarios_generales_update", "")
+        success = update_steps(rows, data, version, steps_updates, consultoria_value, comentarios_generales_value)
+        if success:
+            st.rerun()
+
+# Modos de edición de la pestaña "Actualizar Registro"
+EDIT_MODES = ["Mismos valores para todos", "Por sector (grilla)"]
+
+def grid_columns():
+    """
+    Columnas editables de la grilla: (encabezado, columna de la hoja, opciones o None).
+    """
+    columns = [("Consultoría", CONSULTORIA_COL, ["Sí", "No"])]
+    columns += [(proc["name"], proc["step_col"], proc["options"]) for proc in processes]
+    columns += [(f"Obs. - {proc['name']}", proc["obs_col"], None) for proc in processes]
+    columns.append(("Comentarios generales", COMENTARIOS_COL, None))
+    return columns
+
+# Pestaña "Actualizar Registro" en modo grilla: una fila por sector, guardada en un solo envío
+@st.fragment
+@timed_phase("grilla")
+def sector_grid(data, rows, version):
+    import pandas as pd
+    st.header("Actualizar Registro por Sector")
+    columns = grid_columns()
+
+    table = {"Sector": [cell_value(data[r - 1], 2) for r in rows]}
+    for header, col, options in columns:
+        values = [cell_value(data[r - 1], col) for r in rows]
+        table[header] = [v if v.strip() != "" else "Vacío" for v in values] if options is not None else values
+    # Con object las celdas de texto borradas vuelven como None o NaN, no como texto "nan"
+    frame = pd.DataFrame(table, index=rows, dtype=object)
+
+    column_config = {"Sector": st.column_config.TextColumn("Sector", disabled=True)}
+    for header, col, options in columns:
+        if options is not None:
+            column_config[header] = st.column_config.SelectboxColumn(header, options=["Vacío"] + options, required=True)
+        else:
+            column_config[header] = st.column_config.TextColumn(header)
+
+    grid_key = f"sector_grid_{hash(tuple(rows))}"
+    edited = st.data_editor(frame, column_config=column_config, hide_index=True, num_rows="fixed",
+                            use_container_width=True, key=grid_key)
+
+    if st.button("Guardar Grilla", type="primary", use_container_width=True):
+        now = get_chile_timestamp()
+        cells = []
+        for row_number, record in zip(rows, edited.to_dict("records")):
+            updates = {}
+            for header, col, options in columns:
+                value = "" if pd.isna(record[header]) else record[header]
+                updates[col] = "" if options is not None and value == "Vacío" else value
+            changed = row_changes(data[row_number - 1], updates, now)
+            cells.extend(Cell(row_number, col, value) for col, value in sorted(changed.items()))
+        if not cells:
+            st.info("ℹ️ No hay cambios para guardar.")
+            return
+        save_cells(cells, data, version)
+        st.session_state.pop(grid_key, None)
+        st.rerun(scope="app")
+
+# Cambios mostrados como máximo en el historial y en el panel
+CHANGES_LIMIT = 500
+
+def show_changes(entries, show_account):
+    """
+    Tabla de entradas del registro local de cambios.
+    """
+    labels = column_labels()
+    table = {"Fecha": [e["at"].strftime("%d-%m-%y %H:%M:%S") for e in entries]}
+    if show_account:
+        table["Cuenta"] = [e["cuenta"] for e in entries]
+    table["Sector"] = [e["sector"] for e in entries]
+    if len(get_sheet().shards) > 1:
+        table["Planilla"] = [e["planilla"] for e in entries]
+    table["Campo"] = [labels.get(e["col"], column_letter(e["col"])) for e in entries]
+    table["Antes"] = ["—" if e["old"] is None else e["old"] for e in entries]
+    table["Después"] = [e["new"] for e in entries]
+    st.dataframe(table, hide_index=True, use_container_width=True)
+
+# Historial de cambios de la cuenta guardados desde la app
+def history_tab(selected_cuenta):
+    entries = get_sheet().change_log.history(selected_cuenta, limit=CHANGES_LIMIT)
+    if not entries:
+        st.info("ℹ️ No hay cambios registrados para esta cuenta.")
+        return
+    st.caption(f"Últimos {len(entries)} cambio(s) guardados desde la app.")
+    show_changes(entries, show_account=False)
+
+# Búsqueda por cuenta y sectores, con las pestañas de estado y actualización
+def record_page(data, index, data_version):
+    st.header("Buscar Registro")
     
-    if "rows" not in st.session_state:
-        st.session_state.rows = None
+    # Filtro para ordenar las cuentas (los órdenes vienen precalculados en el índice)
+    selected_order = st.radio("Ordenar cuentas", ORDER_OPTIONS, index=0, horizontal=True)
+    unique_cuentas = sorted_accounts(index, selected_order)
+    
+    # Mostrar el selectbox con las cuentas ordenadas
+    cuentas_options = ["Seleccione una cuenta"] + unique_cuentas
+    selected_cuenta = st.selectbox("Cuenta", cuentas_options, key="cuenta", on_change=reset_search)
+    
+    # Selección de sectores y búsqueda
+    sector_picker(index, selected_cuenta, data_version)
+
+    if "row_refs" not in st.session_state:
+        st.session_state.row_refs = None
 
     # Pestañas para "Estado Actual" y "Actualizar Registro"
-    if st.session_state.rows is not None:
-        tab1, tab2 = st.tabs(["📊 Estado Actual", "📝 Actualizar Registro"])
+    if st.session_state.row_refs is not None:
+        # Observaciones y formulario necesitan las filas completas. Las filas se traducen a la
+        # vista de esos datos, que puede ser más nueva que la de la búsqueda.
+        data, _, version = get_full_rows(st.session_state.row_refs)
+        if data is None:
+            st.stop()
+        rows = [r for r in get_sheet().rows(st.session_state.row_refs, version) if r is not None]
+        if not rows:
+            st.session_state.row_refs = None
+            st.error("❌ No se encontraron registros.")
+            return
+
+        tab1, tab2, tab3 = st.tabs(["📊 Estado Actual", "📝 Actualizar Registro", "🕓 Historial"])
         
         with tab1:
-            st.header("Procesos")
-            headers = ["Cuenta", "Sector", "Consultoría"] + [p["name"] for p in processes] + ["Última Actualización"]
-            table_data = []
-            for row_index in st.session_state.rows:
-                row = data[row_index - 1]
-                row_data = [row[0], row[1], row[2]]
-                for proc in processes:
-                    cell_val = row[proc["step_col"] - 1] if len(row) >= proc["step_col"] else ""
-                    row_data.append(cell_val)
-                row_data.append(row[31] if len(row) > 31 else "")
-                table_data.append(row_data)
-            
-            n_rows = len(table_data)
-            if n_rows <= 3:
-                estado_height = 230
-            elif n_rows <= 10:
-                estado_height = 285
+            status_tab(data, version, rows)
+        
+        with tab2:
+            edit_mode = EDIT_MODES[0]
+            if len(rows) > 1:
+                edit_mode = st.radio("Modo de edición", EDIT_MODES, horizontal=True, key="edit_mode")
+            if edit_mode == EDIT_MODES[0]:
+                update_form(data, rows, version)
             else:
-                estado_height = 500
-            
-            df = pd.DataFrame(table_data, columns=headers)
-            
-            html_table = f"""
-            <style>
-            .status-table {{
-                width: 100%;
-                border-collapse: collapse;
-                font-family: -apple-system, BlinkMacSystemFont, "Segoe UI", Roboto, Helvetica, Arial, sans-serif;
-            }}
-            .status-table th, .status-table td {{
-                border: 1px solid #ddd;
-                padding: 8px;
-                text-align: center;
-            }}
-            .status-table th {{
-                background-color: #f2f2f2;
-                position: sticky;
-                top: 0;
-            }}
-            .status-table tr:nth-child(even) {{
-                background-color: #f9f9f9;
-            }}
-            .status-cell {{
-                border-radius: 4px;
+                sector_grid(data, rows, version)
+
+        with tab3:
+            history_tab(selected_cuenta)
+
+# Vistas disponibles en la barra lateral
+VIEWS = ["📝 Registro", "📥 Importación masiva", "📈 Panel"]
+
+def import_columns():
+    """
+    Encabezados aceptados en la importación -> (columna de la hoja, opciones válidas o None).
+    Coinciden con las etiquetas del formulario de actualización.
+    """
+    columns = {"Consultoría": (CONSULTORIA_COL, ["Sí", "No"])}
+    for proc in processes:
+        columns[proc["name"]] = (proc["step_col"], proc["options"])
+        columns[f"Observaciones - {proc['name']}"] = (proc["obs_col"], None)
+    columns["Comentarios generales"] = (COMENTARIOS_COL, None)
+    return columns
+
+# Leer el archivo subido (memorizado por contenido)
+@st.cache_data(max_entries=4)
+def read_import_file(name, content):
+    import pandas as pd
+    if name.lower().endswith(".xlsx"):
+        frame = pd.read_excel(io.BytesIO(content), dtype=str).fillna("")
+    else:
+        frame = pd.read_csv(io.BytesIO(content), dtype=str, keep_default_na=False, sep=None, engine="python", encoding="utf-8-sig")
+    frame.columns = [str(c).strip() for c in frame.columns]
+    return frame.to_dict("records")
+
+def import_rows(records, index):
+    """
+    Filas de la hoja que corresponden a los pares (Cuenta, Sector) del archivo.
+    """
+    return sorted({r for record in records
+                   for r in index.sectors.get(str(record.get("Cuenta", "")).strip(), {}).get(str(record.get("Sector", "")).strip(), [])})
+
+def plan_import(records, data, index, now):
+    """
+    Resuelve cada registro (Cuenta, Sector) contra el índice, valida los valores y retorna
+    (celdas que cambian, errores [(línea, mensaje)], filas afectadas).
+
+    Una celda vacía en el archivo deja el valor actual; "Vacío" lo borra.
+    """
+    columns = import_columns()
+    errors = []
+    updates_by_row = {}
+    for line, record in enumerate(records, start=2):
+        cuenta = str(record.get("Cuenta", "")).strip()
+        sector = str(record.get("Sector", "")).strip()
+        row_numbers = index.sectors.get(cuenta, {}).get(sector)
+        if not row_numbers:
+            errors.append((line, f"No existe la cuenta/sector '{cuenta}' / '{sector}'."))
+            continue
+        updates = {}
+        for header, (col, options) in columns.items():
+            value = str(record.get(header, "")).strip()
+            if value == "":
+                continue
+            if value == "Vacío":
+                value = ""
+            elif options is not None and value not in options:
+                errors.append((line, f"'{value}' no es válido para {header} (opciones: {', '.join(options)})."))
+                continue
+            updates[col] = value
+        for row_number in row_numbers:
+            updates_by_row.setdefault(row_number, {}).update(updates)
+
+    cells = []
+    for row_number, updates in sorted(updates_by_row.items()):
+        changed = row_changes(data[row_number - 1], updates, now)
+        cells.extend(Cell(row_number, col, value) for col, value in sorted(changed.items()))
+    return cells, errors, sorted(updates_by_row)
+
+def wait_for_queue(cells, version):
+    """
+    Muestra el avance de las celdas dadas en la cola de escrituras hasta que se escriban
+    todas. Solo cuenta esas celdas: la cola es compartida con las demás sesiones.
+    """
+    sheet = get_sheet()
+    total = len(cells)
+    progress = st.progress(0.0, text="Enviando cambios...")
+    while True:
+        status = sheet.queue_status()
+        remaining = sheet.outstanding(cells, version)
+        done = total - remaining
+        text = f"{done} de {total} celdas escritas"
+        if status["last_error"]:
+            text += f" · límite de API alcanzado, reintentando en {status['retry_in']} s"
+        progress.progress(done / total if total else 1.0, text=text)
+        if remaining == 0:
+            break
+        time.sleep(0.5)
+    failures = sheet.failures(sheet.refs(sorted({c.row for c in cells}), version))
+    if failures:
+        st.error(f"❌ No se pudieron guardar {len(failures)} fila(s): {next(iter(failures.values()))}")
+        return False
+    return True
+
+# Importación masiva de estados y observaciones desde CSV o Excel
+@timed_phase("importación")
+def bulk_import_page(index, data_version):
+    st.header("Importación masiva")
+    st.write("Suba un archivo con las columnas **Cuenta** y **Sector**, y cualquiera de las columnas de procesos, "
+             "observaciones, Consultoría o Comentarios generales (mismos nombres que en el formulario). "
+             "Las celdas vacías no modifican la planilla; escriba **Vacío** para borrar un valor.")
+    template = ",".join(["Cuenta", "Sector"] + list(import_columns())) + "\n"
+    st.download_button("Descargar plantilla CSV", template.encode("utf-8-sig"), file_name="plantilla_importacion.csv", mime="text/csv")
+
+    uploaded = st.file_uploader("Archivo CSV o Excel", type=["csv", "xlsx"])
+    if uploaded is None:
+        return
+    try:
+        records = read_import_file(uploaded.name, uploaded.getvalue())
+    except ImportError:
+        st.error("❌ Para leer archivos Excel instale openpyxl (pip install openpyxl) o suba un CSV.")
+        return
+    except Exception as e:
+        st.error(f"❌ No se pudo leer el archivo: {e}")
+        return
+    if not records or "Cuenta" not in records[0] or "Sector" not in records[0]:
+        st.error("❌ El archivo debe tener las columnas Cuenta y Sector.")
+        return
+    unknown = [c for c in records[0] if c not in ("Cuenta", "Sector") and c not in import_columns()]
+    if unknown:
+        st.warning(f"⚠️ Se ignorarán las columnas: {', '.join(unknown)}")
+
+    # Las observaciones y comentarios no vienen en la carga inicial: se leen las filas afectadas.
+    # El plan se arma con el índice de la vista que se leyó; si cambió, se completan sus filas.
+    sheet = get_sheet()
+    version = data_version
+    for _ in range(2):
+        data, index, fetched_version = get_full_rows(sheet.refs(import_rows(records, index), version))
+        if data is None:
+            return
+        unchanged = fetched_version == version
+        version = fetched_version
+        if unchanged:
+            break
+    cells, errors, rows = plan_import(records, data, index, get_chile_timestamp())
+
+    col1, col2, col3 = st.columns(3)
+    col1.metric("Registros en el archivo", len(records))
+    col2.metric("Filas a actualizar", len({c.row for c in cells}))
+    col3.metric("Celdas que cambian", len(cells))
+    if errors:
+        st.warning(f"⚠️ {len(errors)} problema(s). Esas celdas o registros no se importarán.")
+        st.dataframe({"Línea": [e[0] for e in errors], "Problema": [e[1] for e in errors]}, use_container_width=True)
+    if not cells:
+        st.info("ℹ️ No hay cambios para guardar.")
+        return
+
+    if st.button(f"Importar {len(cells)} celdas", type="primary", use_container_width=True):
+        conflicts = save_cells(cells, data, version)
+        if conflicts:
+            st.rerun()
+        if wait_for_queue(cells, version):
+            st.success(f"✅ Importación completa: {len({c.row for c in cells})} filas actualizadas.")
+
+def parse_dates(values):
+    """
+    Convierte una columna de fechas de la planilla a datetime64. Las fechas con el formato
+    exacto "dd-mm-yy HH:MM" se leen dígito a dígito sobre un arreglo de códigos, todas a la
+    vez; solo las demás (sin ceros a la izquierda, por ejemplo) pasan por el formato.
+    """
+    import numpy as np
+    import pandas as pd
+    # Un carácter más que el formato para descartar los textos más largos
+    codes = np.array(values, dtype="U15").view(np.uint32).reshape(len(values), 15).astype(np.int64)
+    digits = codes - ord("0")
+    digit_cols = [0, 1, 3, 4, 6, 7, 9, 10, 12, 13]
+    exact = ((codes[:, 2] == ord("-")) & (codes[:, 5] == ord("-")) & (codes[:, 8] == ord(" "))
+             & (codes[:, 11] == ord(":")) & (codes[:, 14] == 0)
+             & ((digits[:, digit_cols] >= 0) & (digits[:, digit_cols] <= 9)).all(axis=1))
+
+    def two_digits(i):
+        return digits[:, i] * 10 + digits[:, i + 1]
+
+    # Igual que %y: 69-99 son del siglo pasado
+    yy, month, day, hour, minute = (two_digits(i) for i in (6, 3, 0, 9, 12))
+    year = np.where(yy < 69, 2000 + yy, 1900 + yy)
+    exact &= (month >= 1) & (month <= 12) & (day >= 1) & (hour < 24) & (minute < 60)
+    months = np.where(exact, (year - 1970) * 12 + month - 1, 0).astype("datetime64[M]")
+    days = months.astype("datetime64[D]") + np.where(exact, day - 1, 0)
+    # Una fecha imposible (31-02) cae en el mes siguiente: queda para el formato, que la deja vacía
+    exact &= days.astype("datetime64[M]") == months
+    stamps = days.astype("datetime64[m]") + (hour * 60 + minute) * np.timedelta64(1, "m")
+    result = pd.Series(np.where(exact, stamps, np.datetime64("NaT")).astype("datetime64[us]"))
+    others = np.flatnonzero(~exact & (codes[:, 0] != 0))
+    if len(others):
+        result.iloc[others] = pd.to_datetime(pd.Series([values[i] for i in others], dtype=str),
+                                             format=TIMESTAMP_FORMAT, errors="coerce").to_numpy()
+    return result
+
+def build_frame(rows):
+    """
+    Representación por columnas de las filas para el panel: cuenta y estados como
+    categorías y fechas ya convertidas.
+    """
+    import pandas as pd
+    # Trasponer una sola vez: columns[c - 1] es la columna c de la hoja
+    columns = list(itertools.zip_longest(*rows, fillvalue=""))
+    if not columns:
+        columns = [()] * SHEET_WIDTH
+
+    def dates(col):
+        return parse_dates(columns[col - 1])
+
+    frame = pd.DataFrame({
+        "Cuenta": pd.Categorical(columns[0]),
+        "Sector": pd.Series(columns[1], dtype=str),
+        "Última Actualización": dates(LAST_UPDATE_COL),
+    })
+    for proc in processes:
+        states = pd.Series(columns[proc["step_col"] - 1], dtype=str).str.strip().replace("", "Vacío")
+        frame[proc["name"]] = states.astype("category")
+        frame[f"Fecha - {proc['name']}"] = dates(proc["date_col"])
+    return frame
+
+# Fracción de filas cambiadas sobre la cual se vuelve a convertir todo en vez de parchar
+PATCH_MAX_FRACTION = 0.5
+
+class PortfolioFrame:
+    """
+    DataFrame del panel, compartido entre sesiones. Como la copia local reemplaza cada fila
+    modificada por una lista nueva, al cambiar de versión basta comparar identidades para
+    saber qué filas convertir de nuevo; la conversión completa solo ocurre si cambió la
+    cantidad de filas o si cambió más de la mitad de ellas. Las funciones del panel no
+    modifican el DataFrame.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.data = None
+        self.frame = None
+        self.version = None
+
+    def get(self, data, version):
+        with self.lock:
+            if version == self.version:
+                return self.frame
+            changed = None
+            if self.data is not None and len(self.data) == len(data):
+                changed = [i for i, (old, new) in enumerate(zip(self.data[1:], data[1:])) if old is not new]
+            if changed is None or len(changed) > PATCH_MAX_FRACTION * len(data):
+                # Con la mayoría de las filas nuevas, parchar cuesta más que convertir todo
+                frame = build_frame(data[1:])
+            else:
+                frame = self._patch(changed, data) if changed else self.frame
+            self.data, self.frame, self.version = data, frame, version
+            return frame
+
+    def _patch(self, positions, data):
+        import pandas as pd
+        frame = self.frame.copy()
+        part = build_frame([data[i + 1] for i in positions])
+        for column in frame.columns:
+            if isinstance(frame[column].dtype, pd.CategoricalDtype):
+                missing = part[column].cat.categories.difference(frame[column].cat.categories)
+                if len(missing):
+                    frame[column] = frame[column].cat.add_categories(missing)
+            frame.loc[positions, column] = part[column].to_numpy()
+        return frame
+
+@st.cache_resource
+def get_portfolio_frame():
+    return PortfolioFrame()
+
+# Conteo de sectores por proceso y estado
+@st.cache_data(max_entries=8)
+def process_summary(_frame, data_version):
+    import pandas as pd
+    counts = {proc["name"]: _frame[proc["name"]].value_counts() for proc in processes}
+    summary = pd.DataFrame(counts).T.fillna(0).astype(int)
+    summary.columns = summary.columns.astype(str)
+    ordered = [s for s in ["Sí", "Sí (DropControl)", "Sí (CDTEC IF)", "Sí (Ambas)", "Programado", "No", "No aplica", "Vacío"] if s in summary]
+    return summary[ordered + [s for s in summary.columns if s not in ordered]]
+
+# Cuentas sin actualización en los últimos `days` días (o sin fecha)
+@st.cache_data(max_entries=8)
+def stale_accounts(_frame, data_version, days, now):
+    latest = _frame.groupby("Cuenta", observed=True)["Última Actualización"].max()
+    stale = latest[latest.isna() | (latest < now - timedelta(days=days))].sort_values(na_position="first")
+    result = stale.reset_index()
+    result["Días sin actualizar"] = (now - result["Última Actualización"]).dt.days
+    return result
+
+# Procesos en "Programado" hace más de `days` días
+@st.cache_data(max_entries=8)
+def overdue_scheduled(_frame, data_version, days, now):
+    import pandas as pd
+    cutoff = now - timedelta(days=days)
+    parts = []
+    for proc in processes:
+        dates = _frame[f"Fecha - {proc['name']}"]
+        mask = (_frame[proc["name"]] == "Programado") & (dates < cutoff)
+        if mask.any():
+            part = _frame.loc[mask, ["Cuenta", "Sector"]].copy()
+            part["Proceso"] = proc["name"]
+            part["Programado desde"] = dates[mask]
+            parts.append(part)
+    if not parts:
+        return pd.DataFrame(columns=["Cuenta", "Sector", "Proceso", "Programado desde", "Días"])
+    result = pd.concat(parts, ignore_index=True).sort_values("Programado desde")
+    result["Días"] = (now - result["Programado desde"]).dt.days
+    return result
+
+# Panel con el estado de todas las cuentas
+@st.fragment
+@timed_phase("panel")
+def dashboard_page(data, data_version):
+    st.header("Panel General")
+    frame = get_portfolio_frame().get(data, data_version)
+    # Las fechas de la planilla están en hora de Chile, sin zona horaria
+    now = chile_now().replace(tzinfo=None, second=0, microsecond=0)
+
+    col1, col2, col3 = st.columns(3)
+    col1.metric("Cuentas", frame["Cuenta"].nunique())
+    col2.metric("Sectores", len(frame))
+    done = sum(frame[proc["name"]].astype(str).str.startswith("Sí").sum() for proc in processes)
+    col3.metric("Pasos completados", f"{done / (len(frame) * len(processes)):.0%}" if len(frame) else "-")
+
+    st.subheader("Estado por proceso")
+    summary = process_summary(frame, data_version)
+    st.dataframe(summary, use_container_width=True)
+    st.bar_chart(summary, horizontal=True)
+
+    col1, col2 = st.columns(2)
+    stale_days = col1.number_input("Cuentas sin actualizar hace más de (días)", min_value=1, value=30, step=1)
+    overdue_days = col2.number_input("Programados hace más de (días)", min_value=1, value=14, step=1)
+
+    stale = stale_accounts(frame, data_version, stale_days, now)
+    st.subheader(f"Cuentas sin actualizar ({len(stale)})")
+    st.dataframe(stale, hide_index=True, use_container_width=True)
+
+    overdue = overdue_scheduled(frame, data_version, overdue_days, now)
+    st.subheader(f"Procesos programados atrasados ({len(overdue)})")
+    st.dataframe(overdue, hide_index=True, use_container_width=True)
+
+    st.subheader("Cambios recientes")
+    since = st.date_input("Desde", value=now.date() - timedelta(days=7), format="DD-MM-YYYY", key="changes_since")
+    entries = get_sheet().change_log.changed_since(datetime.combine(since, datetime.min.time()), limit=CHANGES_LIMIT)
+    if entries:
+        shown = f", se muestran los últimos {CHANGES_LIMIT}" if len(entries) == CHANGES_LIMIT else ""
+        st.caption(f"{len(entries)} cambio(s) guardados desde la app{shown}.")
+        show_changes(entries, show_account=True)
+    else:
+        st.info("ℹ️ No hay cambios registrados desde esa fecha.")
+
+@timed_phase("total")
+def main():
+    st.session_state.perf_phases = {}
+    st.title("📌 Registro de Procesos")
+    
+    # Botón para abrir cada planilla de Google
+    shards = get_sheet().shards
+    buttons = "".join(f"""
+        <a href="{html.escape(shard.url)}" target="_blank">
+            <button style="
+                background-color: #4CAF50;
                 color: white;
-                padding: 4px 8px;
-                display: inline-block;
-                width: 90%;
+                border: none;
+                padding: 5px 10px;
                 text-align: center;
-            }}
-            .date-cell {{
-                font-size: 0.85em;
-                color: #333;
-            }}
-            </style>
-            <div style="height: {estado_height}px; overflow-y: auto;">
-            <table class="status-table">
-                <thead>
-                    <tr>
-            """
-            for header in headers:
-                html_table += f"<th>{header}</th>"
-            html_table += """
-                    </tr>
-                </thead>
-                <tbody>
-            """
-            for _, row in df.iterrows():
-                html_table += "<tr>"
-                for i, cell in enumerate(row):
-                    if i <= 1:
-                        html_table += f"<td>{cell}</td>"
-                    elif i == len(row) - 1:
-                        html_table += f'<td><div class="date-cell">{cell}</div></td>'
-                    else:
-                        cell_value = cell if cell and cell.strip() != "" else "Vacío"
-                        color = get_state_color(cell_value)
-                        html_table += f"""
-                        <td>
-                            <div class="status-cell" style="background-color: {color};">
-                                {cell_value}
-                            </div>
-                        </td>
-                        """
-                html_table += "</tr>"
-            html_table += """
-                </tbody>
-            </table>
-            </div>
-            """
-            st.components.v1.html(html_table, height=estado_height)
-
-            st.subheader("Observaciones")
-            # Extraer los sectores presentes en las filas seleccionadas
-            sectores_observ = []
-            for r in st.session_state.rows:
-                if len(data[r-1]) > 1:
-                    sectores_observ.append(data[r-1][1])
-            sectores_observ = sorted(set(sectores_observ))
-            if len(sectores_observ) > 1:
-                chosen_sector = st.selectbox("Seleccione el sector para ver observaciones:", sectores_observ, key="observ_sector_select")
-                chosen_row = None
-                for r in st.session_state.rows:
-                    if data[r-1][1] == chosen_sector:
-                        chosen_row = r
-                        break
-                if chosen_row is None:
-                    st.error("No se encontró la fila para el sector seleccionado.")
-                    fila_datos = None
-                else:
-                    fila_datos = data[chosen_row - 1]
-            else:
-                fila_datos = data[st.session_state.rows[0] - 1]
-            
-            if fila_datos:
-                general_comment = fila_datos[30] if len(fila_datos) > 30 and fila_datos[30].strip() != "" else "Vacío"
-                with st.expander("Comentarios Generales", expanded=True):
-                    st.write(general_comment)
-                for proc in processes:
-                    obs_index = proc["obs_col"] - 1
-                    obs_value = fila_datos[obs_index] if len(fila_datos) > obs_index and fila_datos[obs_index].strip() != "" else "Vacío"
-                    with st.expander(proc["name"], expanded=True):
-                        st.write(obs_value)
-        
-        with tab2:
-            st.header("Actualizar Registro")
-            fila_index = st.session_state.rows[0] - 1
-            fila_datos = data[fila_index]
-        
-            # Campo de Consultoría
-            consultoria_default = fila_datos[2] if len(fila_datos) >= 3 else ""
-            display_consultoria = consultoria_default.strip() if consultoria_default and consultoria_default.strip() != "" else "Vacío"
-            consultoria_options = ["Sí", "No"]
-            if display_consultoria not in consultoria_options:
-                consultoria_options = [display_consultoria] + consultoria_options
-            try:
-                consultoria_index = consultoria_options.index(display_consultoria)
-            except ValueError:
-                consultoria_index = 0
-            consultoria_value = st.selectbox("Consultoría", options=consultoria_options, index=consultoria_index, key="consultoria_update")
-        
-            # Dividir en dos columnas: valores y observaciones de cada proceso
-            col1, col2 = st.columns(2)
-        
-            # Columna 1: Valores de cada proceso
-            process_values = {}
-            with col1:
-                for i, proc in enumerate(processes):
-                    default_val = fila_datos[proc["step_col"] - 1] if len(fila_datos) >= proc["step_col"] else ""
-                    display_val = default_val.strip() if default_val and default_val.strip() != "" else "Vacío"
-                    options_for_select = proc["options"].copy()
-                    if display_val not in options_for_select:
-                        options_for_select = [display_val] + options_for_select
-                    default_index = options_for_select.index(display_val)
-                    process_values[proc["name"]] = st.selectbox(
-                        proc["name"],
-                        options=options_for_select,
-                        index=default_index,
-                        key=f"process_{i}_update"
-                    )
-        
-            # Columna 2: Observaciones de cada proceso y comentarios generales
-            process_obs_values = {}
-            with col2:
-                for i, proc in enumerate(processes):
-                    default_obs = fila_datos[proc["obs_col"] - 1] if len(fila_datos) >= proc["obs_col"] else ""
-                    process_obs_values[proc["name"]] = st.text_area(
-                        f"Observaciones - {proc['name']}",
-                        value=default_obs,
-                        height=68,
-                        key=f"obs_{i}_update"
-                    )
-                comentarios_generales = st.text_area("Comentarios generales", value="", height=68, key="comentarios_generales_update")
-            
-            # Botón de guardar cambios con el estilo deseado
-            if st.button("Guardar Cambios", type="primary", use_container_width=True):
-                steps_updates = []
-                for proc in processes:
-                    steps_updates.append({
-                        "step_label": proc["name"],
-                        "step_col": proc["step_col"],
-                        "obs_col": proc["obs_col"],
-                        "date_col": proc["date_col"],
-                        "value": process_values[proc["name"]],
-                        "obs_value": process_obs_values[proc["name"]]
-                    })
-                comentarios_generales_value = st.session_state.get("comentarios_generales_update", "")
-                success = update_steps(st.session_state.rows, steps_updates, consultoria_value, comentarios_generales_value)
-                if success:
-                    st.session_state.update_successful = True
-                    st.rerun()
+                text-decoration: none;
+                display: inline-block;
+                font-size: 14px;
+                border-radius: 5px;
+                cursor: pointer;
+                margin-right: 5px;">
+                Abrir {"Planilla de Google" if len(shards) == 1 else html.escape(shard.name)}
+            </button>
+        </a>""" for shard in shards)
+    html_button = f"""
+    <div style="text-align: left; margin-bottom: 10px;">{buttons}
+    </div>
+    """
+    components.html(html_button, height=50)
+    show_write_status()
+
+    # Cargar datos (la copia local se sincroniza incrementalmente con la planilla)
+    data, index, data_version = get_data()
+
+    if data is None:
+        st.stop()
+
+    stale_since = get_sheet().stale_since()
+    if stale_since:
+        st.warning(f"⚠️ Datos guardados localmente, sin actualizar desde {stale_since.strftime(TIMESTAMP_FORMAT)}. Se actualizarán cuando la planilla responda.")
+
+    show_conflict_prompt(data, data_version)
+
+    # Vista: registro por cuenta o importación masiva
+    view = st.sidebar.radio("Vista", VIEWS, key="view")
+    if view == "📥 Importación masiva":
+        bulk_import_page(index, data_version)
+    elif view == "📈 Panel":
+        dashboard_page(data, data_version)
+    else:
+        record_page(data, index, data_version)
+
+    if st.query_params.get("debug") == "1":
+        show_debug_sidebar()
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,168 @@
+"""
+Informes de la planilla por línea de comandos, sin abrir la app.
+
+    python report.py overdue --days 14 --output programados.csv
+    python report.py stale --days 30 --format json --source snapshot
+
+Las filas se recorren como un flujo (de a un tramo desde la planilla, o de a una desde la
+copia en disco de la app) a través de filtros generadores, y el informe se escribe a medida
+que se produce, sin cargar la hoja completa en memoria.
+"""
+import argparse
+import csv
+import json
+import os
+import sys
+import tomllib
+from datetime import datetime, timedelta
+
+from sheet_data import (
+    TIMESTAMP_FORMAT, LAST_UPDATE_COL, processes, cell_value, parse_timestamp, chile_now,
+    sheet_configs, authorize, open_worksheet, iter_sheet_rows, SnapshotFile, snapshot_path,
+    overview_columns,
+)
+
+# Mismo archivo de secretos que usa la app
+SECRETS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".streamlit", "secrets.toml")
+
+def load_secrets(path):
+    with open(path, "rb") as f:
+        return tomllib.load(f)
+
+def read_rows(secrets, source):
+    """
+    Filas de todas las planillas configuradas, una a una: desde la planilla ("sheet") o desde
+    la copia en disco que mantiene la app ("snapshot").
+    """
+    configs = sheet_configs(secrets)
+    if source == "snapshot":
+        for config in configs:
+            yield from SnapshotFile(snapshot_path(config["url"], config["worksheet"]), overview_columns()).iter_rows()
+        return
+    client = authorize(secrets["gcp_service_account"])
+    for config in configs:
+        yield from iter_sheet_rows(open_worksheet(client, config["url"], config["worksheet"]))
+
+def with_account(rows):
+    """
+    Descarta las filas sin cuenta (filas vacías dentro de la hoja).
+    """
+    return (row for row in rows if cell_value(row, 1).strip())
+
+def format_date(dt):
+    return dt.strftime(TIMESTAMP_FORMAT) if dt else ""
+
+def overdue_scheduled(rows, days, now):
+    """
+    Procesos en "Programado" hace más de `days` días, uno por fila y proceso.
+    """
+    cutoff = now - timedelta(days=days)
+    for row in rows:
+        for proc in processes:
+            if cell_value(row, proc["step_col"]).strip() != "Programado":
+                continue
+            since = parse_timestamp(cell_value(row, proc["date_col"]))
+            if since and since < cutoff:
+                yield {
+                    "Cuenta": row[0],
+                    "Sector": cell_value(row, 2),
+                    "Proceso": proc["name"],
+                    "Programado desde": format_date(since),
+                    "Días": (now - since).days,
+                }
+
+def stale_accounts(rows, days, now):
+    """
+    Cuentas sin actualización en los últimos `days` días (o sin fecha), las más antiguas
+    primero. Guarda solo la última fecha de cada cuenta, no las filas.
+    """
+    latest = {}
+    for row in rows:
+        cuenta = row[0]
+        dt = parse_timestamp(cell_value(row, LAST_UPDATE_COL))
+        previous = latest.get(cuenta)
+        if cuenta not in latest or (dt and (previous is None or dt > previous)):
+            latest[cuenta] = dt
+
+    cutoff = now - timedelta(days=days)
+    stale = sorted(((cuenta, dt) for cuenta, dt in latest.items() if dt is None or dt < cutoff),
+                   key=lambda item: (item[1] is not None, item[1] or datetime.min))
+    for cuenta, dt in stale:
+        yield {
+            "Cuenta": cuenta,
+            "Última Actualización": format_date(dt),
+            "Días sin actualizar": (now - dt).days if dt else "",
+        }
+
+# Informes disponibles: (filtro, columnas, días por defecto)
+REPORTS = {
+    "overdue": (overdue_scheduled, ["Cuenta", "Sector", "Proceso", "Programado desde", "Días"], 14),
+    "stale": (stale_accounts, ["Cuenta", "Última Actualización", "Días sin actualizar"], 30),
+}
+
+def write_csv(records, fields, out):
+    writer = csv.DictWriter(out, fieldnames=fields)
+    writer.writeheader()
+    count = 0
+    for record in records:
+        writer.writerow(record)
+        count += 1
+    return count
+
+def write_json(records, fields, out):
+    """
+    Escribe una lista JSON registro por registro, sin armarla en memoria.
+    """
+    count = 0
+    out.write("[")
+    for record in records:
+        out.write(",\n" if count else "\n")
+        json.dump(record, out, ensure_ascii=False)
+        count += 1
+    out.write("\n]\n" if count else "]\n")
+    return count
+
+WRITERS = {"csv": write_csv, "json": write_json}
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Informes de la planilla de procesos.")
+    parser.add_argument("report", choices=REPORTS, help="overdue: procesos programados atrasados; stale: cuentas sin actualizar")
+    parser.add_argument("--days", type=int, help="antigüedad en días (por defecto 14 para overdue y 30 para stale)")
+    parser.add_argument("--format", choices=WRITERS, default="csv")
+    parser.add_argument("--output", default="-", help="archivo de salida (por defecto, la salida estándar)")
+    parser.add_argument("--source", choices=["sheet", "snapshot"], default="sheet",
+                        help="leer la planilla o la copia en disco de la app")
+    parser.add_argument("--secrets", default=SECRETS_PATH, help="archivo secrets.toml con la configuración")
+    args = parser.parse_args(argv)
+
+    report, fields, default_days = REPORTS[args.report]
+    # Las fechas de la planilla están en hora de Chile, sin zona horaria
+    now = chile_now().replace(tzinfo=None, second=0, microsecond=0)
+    days = args.days if args.days is not None else default_days
+    rows = with_account(read_rows(load_secrets(args.secrets), args.source))
+    records = report(rows, days, now)
+
+    if args.output == "-":
+        try:
+            count = WRITERS[args.format](records, fields, sys.stdout)
+        except ValueError as e:
+            parser.exit(1, f"Error: {e}\n")
+    else:
+        # Se escribe en un archivo temporal junto al destino y solo se renombra si el informe
+        # terminó: un error a mitad de camino (sin copia, API, red) no deja un informe truncado
+        # que parezca completo
+        partial = f"{args.output}.partial"
+        try:
+            with open(partial, "w", newline="", encoding="utf-8") as out:
+                count = WRITERS[args.format](records, fields, out)
+            os.replace(partial, args.output)
+        except BaseException as e:
+            if os.path.exists(partial):
+                os.remove(partial)
+            if isinstance(e, ValueError):
+                parser.exit(1, f"Error: {e}\n")
+            raise
+    print(f"{count} registro(s)", file=sys.stderr)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,443 @@
+"""
+Esquema de la planilla y acceso a los datos, sin depender de Streamlit.
+
+Lo usan la app (code.py) y los informes por línea de comandos (report.py): la definición de
+los procesos y sus columnas, la lectura de fechas, el índice de cuentas y sectores, el
+cliente de Google Sheets y la copia en disco.
+"""
+from datetime import datetime
+from zoneinfo import ZoneInfo
+from contextlib import closing
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+
+import gspread
+from google.auth.transport.requests import AuthorizedSession
+from google.oauth2.service_account import Credentials
+from gspread.utils import rowcol_to_a1
+from requests.adapters import HTTPAdapter
+
+# Formato de fecha usado en las columnas de fecha y en "Última Actualización"
+TIMESTAMP_FORMAT = '%d-%m-%y %H:%M'
+
+def chile_now():
+    return datetime.now(ZoneInfo("America/Santiago"))
+
+def get_chile_timestamp():
+    """
+    Retorna la fecha y hora actual en la zona horaria de Chile con el formato deseado.
+    """
+    return chile_now().strftime(TIMESTAMP_FORMAT)
+
+# Definición centralizada de procesos.
+processes = [
+    {"name": "Proceso Nuevo 1", "step_col": 4, "obs_col": 5, "date_col": 6, "options": ['Sí', 'No', 'Programado']},
+    {"name": "Proceso Nuevo 2", "step_col": 7, "obs_col": 8, "date_col": 9, "options": ['Sí', 'No', 'Programado']},
+    {"name": "Ingreso a Planilla Clientes Nuevos", "step_col": 10, "obs_col": 11, "date_col": 12, "options": ['Sí', 'No']},
+    {"name": "Correo Presentación y Solicitud Información", "step_col": 13, "obs_col": 14, "date_col": 15, "options": ['Sí', 'No', 'Programado']},
+    {"name": "Agregar Puntos Críticos", "step_col": 16, "obs_col": 17, "date_col": 18, "options": ['Sí', 'No']},
+    {"name": "Generar Capacitación Plataforma", "step_col": 19, "obs_col": 20, "date_col": 21, "options": ['Sí (DropControl)', 'Sí (CDTEC IF)', 'Sí (Ambas)', 'No', 'Programado']},
+    {"name": "Generar Documento Power BI", "step_col": 22, "obs_col": 23, "date_col": 24, "options": ['Sí', 'No', 'Programado', 'No aplica']},
+    {"name": "Generar Capacitación Power BI", "step_col": 25, "obs_col": 26, "date_col": 27, "options": ['Sí', 'No', 'Programado', 'No aplica']},
+    {"name": "Generar Estrategia de Riego", "step_col": 28, "obs_col": 29, "date_col": 30, "options": ['Sí', 'No', 'Programado', 'No aplica']}
+]
+
+# Columna "Última Actualización" (última columna usada de la hoja)
+LAST_UPDATE_COL = 32
+SHEET_WIDTH = LAST_UPDATE_COL
+
+# Columnas fijas de la hoja
+CONSULTORIA_COL = 3
+COMENTARIOS_COL = 31
+
+# Estados que registran la fecha del proceso
+DATED_STATES = ['Sí', 'Programado', 'Sí (DropControl)', 'Sí (CDTEC IF)', 'Sí (Ambas)']
+
+def cell_value(row, col):
+    return row[col - 1] if len(row) >= col else ""
+
+# Planillas de origen
+def sheet_configs(secrets):
+    """
+    Planillas de origen como [{"name", "url", "worksheet"}]. Con la lista `spreadsheets` en
+    secrets (url, y opcionalmente worksheet y name) se combinan varias planillas u hojas; si
+    no existe, se usa la primera hoja de `spreadsheet_url`.
+    """
+    configured = secrets.get("spreadsheets")
+    if not configured:
+        return [{"name": "Planilla", "url": secrets["spreadsheet_url"], "worksheet": None}]
+    return [
+        {"name": entry.get("name") or entry.get("worksheet") or f"Planilla {i}",
+         "url": entry["url"], "worksheet": entry.get("worksheet")}
+        for i, entry in enumerate(configured, start=1)
+    ]
+
+# Configuración de credenciales
+scope = [
+    'https://www.googleapis.com/auth/spreadsheets',
+    'https://www.googleapis.com/auth/drive'
+]
+# Conexiones HTTP reutilizables hacia Google (sesiones y hilos de escritura comparten el pool)
+HTTP_POOL_SIZE = 10
+# Tiempo máximo de conexión y de lectura de cada solicitud (segundos)
+HTTP_TIMEOUT = (5, 60)
+
+# Cliente autorizado. AuthorizedSession renueva el token automáticamente y mantiene las
+# conexiones abiertas entre solicitudes.
+def authorize(service_account_info):
+    credentials = Credentials.from_service_account_info(service_account_info, scopes=scope)
+    session = AuthorizedSession(credentials)
+    adapter = HTTPAdapter(pool_connections=HTTP_POOL_SIZE, pool_maxsize=HTTP_POOL_SIZE)
+    session.mount("https://", adapter)
+    gc = gspread.authorize(credentials, session=session)
+    gc.set_timeout(HTTP_TIMEOUT)
+    return gc
+
+# Hoja de trabajo de una planilla (la primera hoja si no se indica otra)
+def open_worksheet(client, url, worksheet=None):
+    spreadsheet = client.open_by_url(url)
+    return spreadsheet.worksheet(worksheet) if worksheet else spreadsheet.sheet1
+
+def column_letter(col):
+    """
+    Retorna la letra de una columna en notación A1 (1 -> "A", 32 -> "AF").
+    """
+    return rowcol_to_a1(1, col)[:-1]
+
+def coalesce_runs(numbers):
+    """
+    Agrupa números de fila o columna ordenados en tramos contiguos [(inicio, fin), ...].
+    """
+    runs = []
+    for number in numbers:
+        if runs and runs[-1][1] == number - 1:
+            runs[-1] = (runs[-1][0], number)
+        else:
+            runs.append((number, number))
+    return runs
+
+def overview_columns():
+    """
+    Columnas que necesitan el selector de cuentas, la tabla de estado y el panel: cuenta,
+    sector, consultoría, el estado y la fecha de cada proceso y "Última Actualización".
+    """
+    return sorted({1, 2, CONSULTORIA_COL, LAST_UPDATE_COL}
+                  | {p["step_col"] for p in processes} | {p["date_col"] for p in processes})
+
+def snapshot_path(url, worksheet=None):
+    key = url if worksheet is None else f"{url}#{worksheet}"
+    return os.path.join(SNAPSHOT_DIR, f"snapshot-{hashlib.sha1(key.encode('utf-8')).hexdigest()[:12]}.sqlite3")
+
+# Opciones de orden para el listado de cuentas
+ORDER_OPTIONS = ["Más recientes primero", "Más antiguos primero", "Orden alfabético"]
+
+def parse_timestamp(date_str):
+    """
+    Convierte una fecha de la planilla a datetime. Retorna None si está vacía o no es válida.
+    """
+    if not date_str or date_str.strip() == "" or date_str == "Vacío":
+        return None
+    try:
+        return datetime.strptime(date_str, TIMESTAMP_FORMAT)
+    except ValueError:
+        return None
+
+# Formato de timestamp_key(), para convertir también las fechas que no vienen con ceros
+TIMESTAMP_KEY_FORMAT = '%y%m%d%H:%M'
+
+def timestamp_key(date_str):
+    """
+    Clave ordenable de una fecha de la planilla ("dd-mm-yy HH:MM" -> "yymmddHH:MM"). Las
+    fechas con ceros a la izquierda (las que escribe la app) se reordenan sin convertirlas;
+    las demás que acepta parse_timestamp() (p. ej. "1-2-25 9:05") se convierten. Retorna None
+    si el texto no es una fecha.
+    """
+    if len(date_str) == 14 and date_str[2] == "-" and date_str[5] == "-" and date_str[8] == " ":
+        return date_str[6:8] + date_str[3:5] + date_str[:2] + date_str[9:]
+    dt = parse_timestamp(date_str)
+    return dt.strftime(TIMESTAMP_KEY_FORMAT) if dt else None
+
+class SheetIndex:
+    """
+    Índice en memoria de la hoja: cuenta -> sector -> números de fila, fecha de última
+    actualización de cada cuenta y los órdenes de cuentas ya calculados.
+    """
+
+    def __init__(self, data):
+        self.sectors = {}
+        # Fecha más reciente de cada cuenta, comparada como texto ordenable: solo se convierte
+        # a datetime la ganadora de cada cuenta, no la fecha de cada fila
+        newest = {}
+        for row_number, row in enumerate(data[1:], start=2):
+            cuenta = row[0]
+            sector = row[1] if len(row) > 1 else ""
+            self.sectors.setdefault(cuenta, {}).setdefault(sector, []).append(row_number)
+            key = timestamp_key(row[31]) if len(row) > 31 else None
+            if key and (cuenta not in newest or key > newest[cuenta][0]):
+                newest[cuenta] = (key, row[31])
+        self.latest_update = {}
+        for cuenta, (_, date_str) in newest.items():
+            dt = parse_timestamp(date_str)
+            if dt is None:
+                # Texto con forma de fecha pero inválido: se revisan todas las filas de la cuenta
+                dates = (parse_timestamp(cell_value(data[r - 1], LAST_UPDATE_COL))
+                         for rows in self.sectors[cuenta].values() for r in rows)
+                dt = max((d for d in dates if d), default=None)
+            if dt:
+                self.latest_update[cuenta] = dt
+        self.sorted_sectors = {cuenta: sorted(sectores) for cuenta, sectores in self.sectors.items()}
+        self._sort_accounts()
+
+    @classmethod
+    def from_dict(cls, saved):
+        """
+        Reconstruye el índice guardado sin volver a leer las fechas de cada fila.
+        """
+        index = cls.__new__(cls)
+        index.sectors = saved["sectors"]
+        index.latest_update = {cuenta: datetime.fromisoformat(dt) for cuenta, dt in saved["latest_update"].items()}
+        index.sorted_sectors = {cuenta: sorted(sectores) for cuenta, sectores in index.sectors.items()}
+        index._sort_accounts()
+        return index
+
+    @classmethod
+    def merged(cls, parts):
+        """
+        Combina los índices de varias planillas [(índice, desplazamiento de filas), ...] sin
+        volver a leer las filas.
+        """
+        index = cls.__new__(cls)
+        index.sectors = {}
+        index.latest_update = {}
+        for part, offset in parts:
+            for cuenta, sectores in part.sectors.items():
+                merged = index.sectors.setdefault(cuenta, {})
+                for sector, rows in sectores.items():
+                    merged.setdefault(sector, []).extend(row + offset for row in rows)
+            for cuenta, dt in part.latest_update.items():
+                if cuenta not in index.latest_update or dt > index.latest_update[cuenta]:
+                    index.latest_update[cuenta] = dt
+        index.sorted_sectors = {cuenta: sorted(sectores) for cuenta, sectores in index.sectors.items()}
+        index._sort_accounts()
+        return index
+
+    def record_update(self, cuenta, dt):
+        """
+        Registra una nueva fecha de actualización para la cuenta y reordena si corresponde.
+        """
+        if dt and (cuenta not in self.latest_update or dt > self.latest_update[cuenta]):
+            self.latest_update[cuenta] = dt
+            self._sort_accounts()
+
+    def _sort_accounts(self):
+        cuentas = list(self.sectors)
+        by_date = lambda acc: self.latest_update.get(acc, datetime.min)
+        self.orders = {
+            "Más recientes primero": sorted(cuentas, key=by_date, reverse=True),
+            "Más antiguos primero": sorted(cuentas, key=by_date),
+            "Orden alfabético": sorted(cuentas, key=lambda acc: acc.lower()),
+        }
+
+    def accounts(self, order):
+        return self.orders[order]
+
+    def sectors_for(self, cuenta):
+        return self.sorted_sectors.get(cuenta, [])
+
+# Buscar filas según cuenta y sectores seleccionados
+def find_rows(selected_cuenta, selected_sectores, index):
+    sectores = index.sectors.get(selected_cuenta, {})
+    if len(selected_sectores) == 0:
+        selected_sectores = sectores.keys()
+    rows = []
+    for sector in selected_sectores:
+        rows.extend(sectores.get(sector, []))
+    return sorted(rows)
+
+# Copia de la hoja en disco, una por planilla (carpeta ignorada por git, configurable con SNAPSHOT_DIR)
+SNAPSHOT_DIR = os.environ.get("SNAPSHOT_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache"))
+# Se incrementa si cambia el formato de la copia en disco
+SNAPSHOT_FORMAT = 2
+
+class SnapshotFile:
+    """
+    Copia de la hoja en disco (SQLite) para servir datos al arrancar y cuando la API no
+    responde. Guarda cada fila como JSON, el índice y la fecha de la última sincronización.
+    Una copia con otro formato o con otras columnas proyectadas se ignora.
+
+    Los sectores del índice solo se reescriben cuando el índice se reconstruyó, y la fecha de
+    última actualización se guarda por cuenta, de modo que un guardado parcial no serializa
+    el índice completo.
+    """
+
+    def __init__(self, path, columns):
+        self.path = path
+        self.stamp = json.dumps({"format": SNAPSHOT_FORMAT, "columns": columns})
+
+    def _connect(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        conn = sqlite3.connect(self.path)
+        conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        conn.execute("CREATE TABLE IF NOT EXISTS rows (row INTEGER PRIMARY KEY, cells TEXT)")
+        conn.execute("CREATE TABLE IF NOT EXISTS latest (cuenta TEXT PRIMARY KEY, at TEXT)")
+        return conn
+
+    def load(self):
+        """
+        Retorna (data, full_rows, index, synced_at) o None si no hay una copia válida.
+        """
+        if not os.path.exists(self.path):
+            return None
+        try:
+            with closing(self._connect()) as conn:
+                meta = dict(conn.execute("SELECT key, value FROM meta"))
+                if meta.get("stamp") != self.stamp:
+                    return None
+                data = [json.loads(cells) for (cells,) in conn.execute("SELECT cells FROM rows ORDER BY row")]
+                if len(data) != int(meta["n_rows"]):
+                    return None
+                index = SheetIndex.from_dict({
+                    "sectors": json.loads(meta["sectors"]),
+                    "latest_update": dict(conn.execute("SELECT cuenta, at FROM latest")),
+                })
+                return data, set(json.loads(meta["full_rows"])), index, datetime.fromisoformat(meta["synced_at"])
+        except (sqlite3.Error, KeyError, ValueError):
+            return None
+
+    def iter_rows(self):
+        """
+        Recorre las filas guardadas (sin el encabezado) de a una, sin cargar la copia completa.
+        """
+        if not os.path.exists(self.path):
+            raise ValueError(f"No existe la copia {self.path}")
+        with closing(self._connect()) as conn:
+            meta = dict(conn.execute("SELECT key, value FROM meta"))
+            if meta.get("stamp") != self.stamp:
+                raise ValueError(f"La copia {self.path} tiene otro formato")
+            for (cells,) in conn.execute("SELECT cells FROM rows WHERE row > 1 ORDER BY row"):
+                yield json.loads(cells)
+
+    def save(self, data, full_rows, index, synced_at, row_numbers=None, reindexed=True):
+        """
+        Guarda la copia. Con `row_numbers` solo se reescriben esas filas (y la fecha de sus
+        cuentas); sin él, la hoja completa. `reindexed` indica si el índice se reconstruyó
+        desde el último guardado.
+        """
+        meta = {
+            "stamp": self.stamp,
+            "n_rows": str(len(data)),
+            "full_rows": json.dumps(sorted(full_rows)),
+            "synced_at": synced_at.isoformat(),
+        }
+        full = row_numbers is None or reindexed
+        if full:
+            meta["sectors"] = json.dumps(index.sectors, ensure_ascii=False)
+            cuentas = index.latest_update
+        else:
+            cuentas = {data[r - 1][0] for r in row_numbers if r <= len(data)}
+        latest = [(cuenta, index.latest_update[cuenta].isoformat()) for cuenta in cuentas if cuenta in index.latest_update]
+        try:
+            with closing(self._connect()) as conn, conn:
+                if row_numbers is None:
+                    conn.execute("DELETE FROM rows")
+                    row_numbers = range(1, len(data) + 1)
+                conn.executemany(
+                    "INSERT OR REPLACE INTO rows (row, cells) VALUES (?, ?)",
+                    ((r, json.dumps(data[r - 1], ensure_ascii=False)) for r in row_numbers if r <= len(data)),
+                )
+                if full:
+                    conn.execute("DELETE FROM latest")
+                conn.executemany("INSERT OR REPLACE INTO latest (cuenta, at) VALUES (?, ?)", latest)
+                conn.executemany("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", meta.items())
+        except (sqlite3.Error, OSError):
+            # La copia en disco es opcional: un fallo al guardarla no debe afectar a la app
+            pass
+
+# Registro local de cambios, compartido por todas las planillas
+def change_log_path():
+    return os.path.join(SNAPSHOT_DIR, "changes.sqlite3")
+
+class ChangeLog:
+    """
+    Registro local, solo de agregado, de los cambios guardados desde la app: una entrada por
+    celda con la cuenta, el sector, la planilla, el valor anterior y el nuevo (SQLite). Está
+    indexado por fecha y por cuenta para consultar qué cambió desde una fecha y el historial
+    de una cuenta sin recorrer la hoja.
+
+    El valor anterior es None si la fila no estaba completa en la copia local.
+    """
+
+    FIELDS = ["at", "cuenta", "sector", "planilla", "row", "col", "old", "new"]
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+
+    def _connect(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        conn = sqlite3.connect(self.path)
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS changes (id INTEGER PRIMARY KEY, at TEXT NOT NULL, cuenta TEXT NOT NULL, "
+            "sector TEXT NOT NULL, planilla TEXT NOT NULL, row INTEGER NOT NULL, col INTEGER NOT NULL, old TEXT, new TEXT)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS changes_at ON changes (at)")
+        conn.execute("CREATE INDEX IF NOT EXISTS changes_cuenta_at ON changes (cuenta, at)")
+        return conn
+
+    def append(self, entries, at=None):
+        """
+        Agrega entradas (cuenta, sector, planilla, fila, columna, anterior, nuevo) con la
+        fecha `at` (por defecto, ahora en hora de Chile).
+        """
+        if not entries:
+            return
+        at = (at or chile_now()).replace(tzinfo=None, microsecond=0).isoformat(" ")
+        try:
+            with self.lock, closing(self._connect()) as conn, conn:
+                conn.executemany(
+                    "INSERT INTO changes (at, cuenta, sector, planilla, row, col, old, new) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    ((at, *entry) for entry in entries),
+                )
+        except (sqlite3.Error, OSError):
+            # El registro es opcional: un fallo al escribirlo no debe afectar al guardado
+            pass
+
+    def changed_since(self, since, limit=None):
+        """
+        Cambios desde `since` (datetime en hora de Chile), los más recientes primero.
+        """
+        return self._query("WHERE at >= ?", (since.replace(tzinfo=None).isoformat(" "),), limit)
+
+    def history(self, cuenta, limit=None):
+        """
+        Cambios de una cuenta, los más recientes primero.
+        """
+        return self._query("WHERE cuenta = ?", (cuenta,), limit)
+
+    def _query(self, where, params, limit):
+        if not os.path.exists(self.path):
+            return []
+        sql = f"SELECT {', '.join(self.FIELDS)} FROM changes {where} ORDER BY at DESC, id DESC"
+        if limit is not None:
+            sql += f" LIMIT {int(limit)}"
+        try:
+            with closing(self._connect()) as conn:
+                rows = conn.execute(sql, params).fetchall()
+        except sqlite3.Error:
+            return []
+        return [dict(zip(self.FIELDS, row), at=datetime.fromisoformat(row[0])) for row in rows]
+
+# Filas por lectura al recorrer la hoja completa
+READ_CHUNK_ROWS = 1000
+
+def iter_sheet_rows(worksheet, chunk_rows=READ_CHUNK_ROWS):
+    """
+    Recorre las filas de la hoja (sin el encabezado) leyendo de a `chunk_rows` filas, de modo
+    que nunca hay más de un tramo en memoria.
+    """
+    for start in range(2, worksheet.row_count + 1, chunk_rows):
+        end = min(start + chunk_rows - 1, worksheet.row_count)
+        yield from worksheet.batch_get([f"A{start}:{rowcol_to_a1(end, SHEET_WIDTH)}"])[0]